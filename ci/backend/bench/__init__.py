@@ -0,0 +1,2 @@
+""" Benchmarks and load harnesses that drive the portal in-process against local fakes.
+"""
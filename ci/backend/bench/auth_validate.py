@@ -0,0 +1,165 @@
+""" Microbenchmark for /auth/validate, the subrequest behind every proxied request.
+
+    Requests go through the ASGI interface in-process, with a fake CustomObjectsApi
+    and a local token issuer, so the numbers are the portal's own cost. Each
+    scenario is run in three modes:
+
+    - cached: informers synced and the auth decision cache on (steady state)
+    - uncached: informers synced, every request verifies its JWT and checks
+      entitlements (handles are always resolved from the store)
+    - api: informers not synced, CR reads go to the (fake) Kubernetes API
+
+Usage (from ci/backend):
+    python -m bench.auth_validate [--requests 2000] [--concurrency 16] [--k8s-latency 0.005]
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+from starlette.requests import Request
+
+from bench import fakes
+
+main = fakes.main
+
+PROJECT_HOST = f"jupyter.{main.K8TRE_EXTERNAL_DOMAIN}"
+GUACAMOLE_HOST = f"guacamole.{main.K8TRE_EXTERNAL_DOMAIN}"
+
+MODES = ("cached", "uncached", "api")
+
+
+async def scenarios(issuer):
+    """ (name, expected status, request headers) for each path through auth_validate
+    """
+    token = issuer.token("alice", groups=["researchers"])
+    no_cookies = Request({"type": "http", "headers": []})
+    handle = await main._issue_auth_handle(no_cookies, "alpha", token, main.verify_token(f"Bearer {token}"))
+
+    def request(host, uri, cookies=None):
+        headers = {
+            "x-original-url": f"https://{host}{uri}",
+            "x-forwarded-proto": "https",
+        }
+        if cookies:
+            headers["cookie"] = "; ".join(f"{k}={v}" for k, v in cookies.items())
+        return headers
+
+    return [
+        ("static asset", 200, request(PROJECT_HOST, "/hub/static/js/home.js")),
+        ("guacamole tunnel", 200, request(
+            GUACAMOLE_HOST, "/guacamole/websocket-tunnel?token=0123456789abcdef",
+            {"k8tre-project": "alpha", "k8tre-auth-token-alpha": token},
+        )),
+        ("hub query token", 200, request(PROJECT_HOST, f"/hub/login?token={token}&project=alpha")),
+        ("project cookie", 200, request(
+            PROJECT_HOST, "/user/alice/lab",
+            {"k8tre-project": "alpha", "k8tre-auth-token-alpha": token},
+        )),
+        ("project handle", 200, request(
+            PROJECT_HOST, "/user/alice/lab",
+            {"k8tre-project": "alpha", "k8tre-auth-token-alpha": handle},
+        )),
+        ("global cookie", 200, request(
+            PROJECT_HOST, "/user/alice/lab",
+            {"k8tre-project": "alpha", "k8tre-auth-token": token},
+        )),
+        ("denied project", 403, request(
+            PROJECT_HOST, "/user/alice/lab",
+            {"k8tre-project": "beta", "k8tre-auth-token-beta": token},
+        )),
+    ]
+
+
+def set_mode(api, issuer, mode):
+    fakes.install(api, issuer, informers=mode != "api")
+    ttl = main.AUTH_DECISION_CACHE_TTL if mode == "cached" else 0
+    main.auth_decisions.ttl = ttl
+    main.rejected_tokens.ttl = ttl
+
+
+async def run_scenario(client, api, headers, expected, requests, concurrency):
+    """ Send `requests` identical requests from `concurrency` workers.
+    """
+    # One untimed request to fill whatever caches the mode allows
+    await client.get("/auth/validate", headers=headers)
+    api.reset_calls()
+
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            response = await client.get("/auth/validate", headers=headers)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != expected:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput": requests / elapsed,
+        "p50_ms": percentiles[49] * 1000,
+        "p99_ms": percentiles[98] * 1000,
+        "k8s_calls_per_request": api.total_calls / requests,
+    }
+
+
+async def run(args):
+    api = fakes.FakeCustomObjectsApi(latency=args.k8s_latency)
+    fakes.seed_identities(
+        api,
+        users={"alice": ["researchers"]},
+        groups={"researchers": ["alpha"], "others": ["beta"]},
+        projects=["alpha", "beta"],
+    )
+    issuer = fakes.LocalIssuer()
+
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://portal.backend.svc.cluster.local") as client:
+        for mode in args.modes:
+            set_mode(api, issuer, mode)
+            for name, expected, headers in await scenarios(issuer):
+                result = await run_scenario(client, api, headers, expected, args.requests, args.concurrency)
+                results.append({"mode": mode, "scenario": name, **result})
+    return results
+
+
+def report(results):
+    print(f"{'mode':<9} {'scenario':<17} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'k8s/req':>8} {'errors':>7}")
+    for r in results:
+        print(
+            f"{r['mode']:<9} {r['scenario']:<17} {r['throughput']:>9.0f} {r['p50_ms']:>8.3f} "
+            f"{r['p99_ms']:>8.3f} {r['k8s_calls_per_request']:>8.2f} {r['errors']:>7}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario and mode")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent in-flight requests")
+    parser.add_argument("--k8s-latency", type=float, default=0.005, help="seconds added to each fake Kubernetes call")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
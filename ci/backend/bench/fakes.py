@@ -0,0 +1,483 @@
+""" Local stand-ins for Kubernetes, Keycloak and Guacamole, so the portal can be driven
+    in-process.
+
+    Importing this module imports main with in-cluster config stubbed out; use
+    `install()` to swap its Kubernetes clients for a FakeCustomObjectsApi and its
+    JWKS for a LocalIssuer that signs test tokens, and `install_upstreams()` to
+    route its Keycloak and Guacamole calls to FakeKeycloak and FakeGuacamole.
+    With SESSION_STORE=redis and no SESSION_REDIS_URL, sessions go to a local
+    fakeredis server.
+"""
+
+import asyncio
+import collections
+import copy
+import json
+import os
+import threading
+import time
+import types
+import urllib.parse
+import uuid
+
+import httpx
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+from kubernetes import config
+from kubernetes.client.rest import ApiException
+
+os.environ.setdefault("JSON_SECRET_KEY", "00" * 32)
+os.environ.setdefault("KEYCLOAK_CLIENT_ID", "backend")
+os.environ.setdefault("KEYCLOAK_CLIENT_SECRET", "bench")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+if os.environ.get("SESSION_STORE") == "redis" and "SESSION_REDIS_URL" not in os.environ:
+    import socket
+
+    import fakeredis
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        redis_port = sock.getsockname()[1]
+    redis_server = fakeredis.TcpFakeServer(("127.0.0.1", redis_port))
+    redis_server.daemon_threads = True
+    threading.Thread(target=redis_server.serve_forever, name="fakeredis", daemon=True).start()
+    os.environ["SESSION_REDIS_URL"] = f"redis://127.0.0.1:{redis_port}/0"
+
+# main loads the cluster config on import, there is none here
+config.load_incluster_config = lambda *args, **kwargs: None
+config.load_kube_config = lambda *args, **kwargs: None
+
+import main  # noqa: E402
+
+
+class LocalIssuer:
+    """ RSA signing key standing in for the Keycloak realm, with its JWKS.
+    """
+
+    def __init__(self, kid="bench"):
+        self.kid = kid
+        self.issuer = f"{main.build_service_url('keycloak')}/realms/{main.keycloak_realm}"
+        self.audience = os.environ["KEYCLOAK_CLIENT_ID"]
+        self._key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(RSAAlgorithm.to_jwk(self._key.public_key()))
+        jwk.update(kid=kid, use="sig", alg="RS256")
+        self.jwks = {"keys": [jwk]}
+
+    def token(self, username, groups=(), lifetime=3600, **claims):
+        """ Sign an access token for username, as Keycloak would issue it
+        """
+        now = int(time.time())
+        payload = {
+            "iss": self.issuer,
+            "aud": self.audience,
+            "sub": str(uuid.uuid5(uuid.NAMESPACE_URL, username)),
+            "preferred_username": username,
+            "email": f"{username}@example.org",
+            "groups": list(groups),
+            "iat": now,
+            "exp": now + lifetime,
+            **claims,
+        }
+        return jwt.encode(payload, self._key, algorithm="RS256", headers={"kid": self.kid})
+
+
+class _Response:
+    """ Just enough of urllib3's response for `_preload_content=False` callers
+    """
+
+    status = 200
+
+    def __init__(self, body):
+        self.data = json.dumps(body).encode()
+
+
+class FakeCustomObjectsApi:
+    """ In-memory CustomObjectsApi that counts calls and can add latency to each.
+
+        Objects are keyed by (plural, namespace, name) and only the calls the portal
+        makes are implemented. `latency` is slept in the calling thread, like a
+        round trip to the API server. Every change is passed to the listeners as
+        listener(event_type, plural, obj), which is how watches are simulated.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.listeners = []
+        self._objects = {}
+        self._resource_version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def reset_calls(self):
+        self.calls.clear()
+
+    def _call(self, verb):
+        with self._lock:
+            self.calls[verb] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _next_version(self):
+        self._resource_version += 1
+        return str(self._resource_version)
+
+    def _emit(self, event_type, plural, obj):
+        for listener in self.listeners:
+            listener(event_type, plural, copy.deepcopy(obj))
+
+    def add(self, group, version, namespace, plural, name, spec=None, status=None, labels=None, **fields):
+        """ Seed an object without counting it as an API call
+        """
+        obj = {
+            "apiVersion": f"{group}/{version}" if group else version,
+            "metadata": {"name": name, "namespace": namespace, "labels": dict(labels or {})},
+            "spec": spec or {},
+            **fields,
+        }
+        if status is not None:
+            obj["status"] = status
+        with self._lock:
+            event_type = "MODIFIED" if (plural, namespace, name) in self._objects else "ADDED"
+            obj["metadata"]["resourceVersion"] = self._next_version()
+            self._objects[(plural, namespace, name)] = obj
+        self._emit(event_type, plural, obj)
+        return obj
+
+    def update(self, namespace, plural, name, body):
+        """ Merge patch an object without counting it as an API call, as a controller would
+        """
+        with self._lock:
+            obj = self._objects.get((plural, namespace, name))
+            if obj is None:
+                raise ApiException(status=404, reason=f"{plural} {name} not found")
+            _merge(obj, body)
+            obj["metadata"]["resourceVersion"] = self._next_version()
+            result = copy.deepcopy(obj)
+        self._emit("MODIFIED", plural, result)
+        return result
+
+    def get(self, namespace, plural, name):
+        """ Read an object without counting it as an API call, None if there is none.
+        """
+        with self._lock:
+            obj = self._objects.get((plural, namespace, name))
+            return copy.deepcopy(obj) if obj is not None else None
+
+    def _list(self, plural, namespace, label_selector, _preload_content):
+        selector = dict(
+            term.split("=", 1) for term in (label_selector or "").split(",") if "=" in term
+        )
+        with self._lock:
+            items = [
+                copy.deepcopy(obj) for (p, ns, _), obj in self._objects.items()
+                if p == plural and namespace in (None, ns)
+                and all(obj["metadata"]["labels"].get(k) == v for k, v in selector.items())
+            ]
+            body = {"items": items, "metadata": {"resourceVersion": str(self._resource_version)}}
+        return body if _preload_content else _Response(body)
+
+    def get_namespaced_custom_object(self, group, version, namespace, plural, name, **kwargs):
+        self._call("get")
+        with self._lock:
+            obj = self._objects.get((plural, namespace, name))
+            if obj is None:
+                raise ApiException(status=404, reason=f"{plural} {name} not found")
+            return copy.deepcopy(obj)
+
+    def list_namespaced_custom_object(self, group, version, namespace, plural,
+                                      label_selector=None, _preload_content=True, **kwargs):
+        self._call("list")
+        return self._list(plural, namespace, label_selector, _preload_content)
+
+    def list_cluster_custom_object(self, group, version, plural,
+                                   label_selector=None, _preload_content=True, **kwargs):
+        self._call("list")
+        return self._list(plural, None, label_selector, _preload_content)
+
+    def create_namespaced_custom_object(self, group, version, namespace, plural, body, **kwargs):
+        self._call("create")
+        name = body["metadata"]["name"]
+        with self._lock:
+            if (plural, namespace, name) in self._objects:
+                raise ApiException(status=409, reason=f"{plural} {name} already exists")
+            obj = copy.deepcopy(body)
+            obj["metadata"].setdefault("labels", {})
+            obj["metadata"].update(namespace=namespace, resourceVersion=self._next_version())
+            self._objects[(plural, namespace, name)] = obj
+            result = copy.deepcopy(obj)
+        self._emit("ADDED", plural, result)
+        return result
+
+    def patch_namespaced_custom_object(self, group, version, namespace, plural, name, body, **kwargs):
+        self._call("patch")
+        return self.update(namespace, plural, name, body)
+
+    def delete_namespaced_custom_object(self, group, version, namespace, plural, name, **kwargs):
+        self._call("delete")
+        with self._lock:
+            obj = self._objects.pop((plural, namespace, name), None)
+            if obj is None:
+                raise ApiException(status=404, reason=f"{plural} {name} not found")
+        self._emit("DELETED", plural, obj)
+        return {"status": "Success"}
+
+
+class FakeCoreApi:
+    """ The CoreV1Api and DiscoveryV1Api calls the portal makes, over the pods and
+        EndpointSlices held (as "pods" and "endpointslices") by a FakeCustomObjectsApi,
+        whose call counter and latency they share.
+    """
+
+    def __init__(self, api):
+        self.api = api
+
+    def list_endpoint_slice_for_all_namespaces(self, label_selector=None, _preload_content=True, **kwargs):
+        self.api._call("list")
+        return self.api._list("endpointslices", None, label_selector, _preload_content)
+
+    def read_namespaced_pod(self, name, namespace, **kwargs):
+        self.api._call("get")
+        pod = self.api.get(namespace, "pods", name)
+        if pod is None:
+            raise ApiException(status=404, reason=f"pods {name} not found")
+        return types.SimpleNamespace(status=types.SimpleNamespace(pod_ip=pod["status"].get("podIP")))
+
+    def read_namespaced_endpoints(self, name, namespace, **kwargs):
+        self.api._call("get")
+        endpoint_slice = self.api.get(namespace, "endpointslices", name)
+        if endpoint_slice is None:
+            raise ApiException(status=404, reason=f"endpoints {name} not found")
+        addresses = [
+            address for endpoint in endpoint_slice["endpoints"]
+            if (endpoint.get("conditions") or {}).get("ready") is not False
+            for address in endpoint["addresses"]
+        ]
+        return types.SimpleNamespace(subsets=[types.SimpleNamespace(addresses=addresses)])
+
+
+def _merge(target, patch):
+    """ JSON merge patch of patch into target, in place
+    """
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+def seed_identities(api, users, groups, projects):
+    """ Add User, Group and Project CRs.
+
+        users maps username -> groups, groups maps group -> projects and projects
+        is a list of project names, each getting a jupyter and a VDI app.
+    """
+    identity = main.CR_KINDS["users"]
+    research = main.CR_KINDS["projects"]
+    for username, user_groups in users.items():
+        api.add(*identity, main.NAMESPACE, "users", username, spec={"groups": list(user_groups)})
+    for group_name, group_projects in groups.items():
+        api.add(*identity, main.NAMESPACE, "groups", group_name, spec={"projects": list(group_projects)})
+    for project in projects:
+        api.add(*research, main.NAMESPACE, "projects", project, spec={
+            "description": f"Benchmark project {project}",
+            "apps": [{"name": "jupyter", "type": "jupyter"}, {"name": "vdi", "type": "vdi"}],
+        })
+
+
+# Informer fed by each kind of object held by the fake API
+INFORMERS = {
+    **main.cr_informers,
+    "vdiinstances": main.vdi_informers["vdiinstances"],
+    "endpointslices": main.vdi_informers["endpointslices"],
+}
+
+
+def install(api, issuer, informers=True):
+    """ Point main at the fake API and local issuer.
+
+        With informers the informers do their initial list against the fake and
+        then receive its changes as watch events, so reads are served from memory
+        as in a synced deployment. Without, they stay unsynced and every read goes
+        to the API. No watch threads are started.
+    """
+    core = FakeCoreApi(api)
+    main.k8s_api = main.CoalescingCustomObjectsApi(api)
+    main.k8s_core_api = core
+    main.k8s_discovery_api = core
+    main.jwks_cache._client.fetch_data = lambda: issuer.jwks
+    main.jwks_cache.refresh()
+
+    api.listeners = [listener for listener in api.listeners if listener is not _deliver]
+    for informer in INFORMERS.values():
+        name = informer._list_func.__name__
+        informer._list_func = getattr(api if hasattr(api, name) else core, name)
+        informer._resource_version = None
+        informer._synced.clear()
+        if informers:
+            informer._relist()
+    if informers:
+        api.listeners.append(_deliver)
+
+    main.active_user_sessions.clear()
+    for cache in main.TTLCache.instances.values():
+        cache.clear()
+
+
+def _deliver(event_type, plural, obj):
+    informer = INFORMERS.get(plural)
+    if informer is not None and informer.synced:
+        informer._apply(event_type, obj)
+
+
+class FakeVDIController:
+    """ Brings up the desktop of each VDIInstance created through the fake API.
+
+        After `boot_time` seconds the instance is Running with a password, its
+        pod has an IP, its service has a ready endpoint and its RDP port is open
+        (in `rdp_hosts`, for FakeRDPProber). Nothing it does counts as an API call.
+    """
+
+    def __init__(self, api, loop, boot_time=5.0):
+        self.api = api
+        self.loop = loop
+        self.boot_time = boot_time
+        self.rdp_hosts = set()
+        self._next_ip = 0
+        api.listeners.append(self._on_event)
+
+    def _on_event(self, event_type, plural, obj):
+        if plural == "vdiinstances" and event_type == "ADDED":
+            metadata = obj["metadata"]
+            self.loop.call_soon_threadsafe(
+                self.loop.call_later, self.boot_time, self._boot, metadata["namespace"], metadata["name"], obj["spec"]
+            )
+
+    def _boot(self, namespace, name, spec):
+        username, project = spec["user"], spec["project"]
+        service_name = f"vdi-{username}-{project}"
+        self._next_ip += 1
+        pod_ip = f"10.{self._next_ip >> 16 & 255}.{self._next_ip >> 8 & 255}.{self._next_ip & 255}"
+
+        pod_name = main._get_vdi_pod_name(username, project)
+        self.api.add("", "v1", namespace, "pods", pod_name, status={"podIP": pod_ip})
+        self.api.add("discovery.k8s.io", "v1", namespace, "endpointslices", service_name,
+                     labels={main.SERVICE_NAME_LABEL: service_name},
+                     endpoints=[{"addresses": [pod_ip], "conditions": {"ready": True},
+                                 "targetRef": {"kind": "Pod", "namespace": namespace, "name": pod_name}}])
+        self.rdp_hosts.add(f"{service_name}.{namespace}.svc.cluster.local")
+        self.api.update(namespace, "vdiinstances", name, {
+            "status": {"phase": "Running", "password": uuid.uuid4().hex, "linuxUser": username}
+        })
+
+
+class FakeRDPProber(main.RDPProber):
+    """ RDPProber whose RDP port checks succeed for the hosts in open_hosts
+    """
+
+    def __init__(self, open_hosts, min_interval=0.2, max_interval=1.0):
+        super().__init__(
+            main.RDP_PORT, main.RDP_PROBE_TIMEOUT, min_interval, max_interval,
+            main.RDP_PROBE_IDLE_TIMEOUT, on_change=main.vdi_status_broadcaster.notify
+        )
+        self.open_hosts = open_hosts
+
+    async def _connect(self, host):
+        return host in self.open_hosts
+
+
+class FakeKeycloak:
+    """ The Keycloak endpoints the portal calls, as an httpx.MockTransport handler,
+        plus the authorization code exchange done by authlib.
+
+        The authorization code is taken to be the username. A user's access token is
+        reused until half its lifetime has passed, so signing does not load the
+        event loop being measured. Calls are counted by endpoint and each waits
+        `latency` seconds.
+    """
+
+    def __init__(self, issuer, latency=0.0, token_lifetime=3600):
+        self.issuer = issuer
+        self.latency = latency
+        self.token_lifetime = token_lifetime
+        self.calls = collections.Counter()
+        self._tokens = {}
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def _tokens_for(self, username):
+        tokens, minted = self._tokens.get(username, (None, 0))
+        if tokens is None or time.time() - minted > self.token_lifetime / 2:
+            tokens = {
+                "access_token": self.issuer.token(username, lifetime=self.token_lifetime),
+                "refresh_token": f"refresh.{username}",
+                "token_type": "Bearer",
+            }
+            self._tokens[username] = (tokens, time.time())
+        return tokens
+
+    async def _call(self, endpoint):
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def authorize_access_token(self, request, **kwargs):
+        await self._call("token")
+        return dict(self._tokens_for(request.query_params["code"]))
+
+    async def handle(self, request):
+        endpoint = request.url.path.rsplit("/", 1)[-1]
+        await self._call(endpoint)
+        if endpoint == "userinfo":
+            token = request.headers.get("authorization", "").removeprefix("Bearer ")
+            claims = jwt.decode(token, options={"verify_signature": False})
+            return httpx.Response(200, json={
+                key: claims[key] for key in ("sub", "preferred_username", "email", "groups")
+            })
+        if endpoint == "token":
+            form = urllib.parse.parse_qs(request.content.decode())
+            refresh_token = form.get("refresh_token", [""])[0]
+            if not refresh_token.startswith("refresh."):
+                return httpx.Response(400, json={"error": "invalid_grant"})
+            return httpx.Response(200, json=self._tokens_for(refresh_token.removeprefix("refresh.")))
+        if endpoint == "revoke":
+            return httpx.Response(200)
+        return httpx.Response(404)
+
+
+class FakeGuacamole:
+    """ Guacamole's token endpoint as an httpx.MockTransport handler
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = collections.Counter()
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    async def handle(self, request):
+        self.calls["tokens"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if request.method == "POST" and request.url.path == "/guacamole/api/tokens":
+            return httpx.Response(200, json={"authToken": uuid.uuid4().hex})
+        return httpx.Response(404)
+
+
+def install_upstreams(keycloak, guacamole):
+    """ Route the portal's Keycloak and Guacamole calls to the fakes
+    """
+    main.http_clients["keycloak"] = httpx.AsyncClient(transport=httpx.MockTransport(keycloak.handle))
+    main.http_clients["guacamole"] = httpx.AsyncClient(transport=httpx.MockTransport(guacamole.handle))
+    main.oauth.keycloak.authorize_access_token = keycloak.authorize_access_token
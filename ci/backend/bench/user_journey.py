@@ -0,0 +1,235 @@
+""" Load harness for the portal, simulating researchers going through a whole session.
+
+    Each researcher logs in (OAuth callback), lists their projects, launches Jupyter
+    or a VDI and then either makes a few proxied hub requests (/auth/validate) or
+    polls the VDI status until the desktop is ready and connects to it, and finally
+    logs out. Kubernetes, Keycloak and Guacamole are in-process fakes with
+    configurable latency; VDIs boot after --vdi-boot-time seconds.
+
+    For every number of concurrent researchers it reports the latency distribution
+    of each step and how many backend calls one journey costs, to show where the
+    portal stops scaling.
+
+Usage (from ci/backend):
+    python -m bench.user_journey [--users 10 50 100 200] [--vdi-fraction 0.5] [--no-informers]
+
+    Set SESSION_STORE=memory or SESSION_STORE=redis (served by fakeredis, see
+    bench/requirements.txt) to compare session stores, and
+    K8TRE_AUTH_COOKIE_HANDLES=true to give project apps handle cookies instead of JWTs.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import random
+import statistics
+import time
+
+import httpx
+
+from bench import fakes
+
+main = fakes.main
+
+PORTAL_URL = main.build_service_url("portal")
+JUPYTER_HOST = f"jupyter.{main.K8TRE_EXTERNAL_DOMAIN}"
+
+
+class JourneyFailed(Exception):
+    pass
+
+
+class Recorder:
+    """ Latencies and failures of each step, across all researchers of a run
+    """
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.session_cookie_bytes = 0
+        self.auth_cookie_bytes = 0
+
+    async def step(self, name, http, path, expected, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await http.get(path, **kwargs)
+        except Exception as e:
+            self.errors[name] += 1
+            raise JourneyFailed(f"{name}: {e!r}")
+        self.latencies[name].append(time.perf_counter() - start)
+        session_cookie = http.cookies.get("k8tre-session") or ""
+        self.session_cookie_bytes = max(self.session_cookie_bytes, len(session_cookie))
+        if response.status_code != expected:
+            self.errors[name] += 1
+            raise JourneyFailed(f"{name}: {response.status_code}")
+        return response
+
+
+async def researcher(recorder, args, username, project, use_vdi):
+    await asyncio.sleep(random.uniform(0, args.ramp))
+    transport = httpx.ASGITransport(app=main.app, client=(f"192.0.2.{random.randint(1, 254)}", 40000))
+    async with httpx.AsyncClient(transport=transport, base_url=PORTAL_URL) as http:
+        await recorder.step("login", http, "/auth/callback", 307, params={"code": username, "state": "bench"})
+        await recorder.step("projects", http, "/projects", 200)
+
+        if use_vdi:
+            await recorder.step("launch_vdi", http, f"/launch/{project}/vdi", 307)
+            launched = time.perf_counter()
+            while True:
+                response = await recorder.step("vdi_status", http, f"/api/vdi/status/{username}/{project}", 200)
+                if response.json()["is_ready"]:
+                    break
+                if time.perf_counter() - launched > args.ready_timeout:
+                    recorder.errors["vdi_ready"] += 1
+                    raise JourneyFailed("vdi_ready: timed out")
+                await asyncio.sleep(args.poll_interval)
+            recorder.latencies["vdi_ready"].append(time.perf_counter() - launched)
+            await recorder.step("vdi_connect", http, f"/api/vdi/connect/{username}/{project}", 307)
+        else:
+            response = await recorder.step("launch_jupyter", http, f"/launch/{project}/jupyter", 307)
+            auth_cookie = response.cookies[f"k8tre-auth-token-{project}"]
+            recorder.auth_cookie_bytes = max(recorder.auth_cookie_bytes, len(auth_cookie))
+            cookie = f"k8tre-project={project}; k8tre-auth-token-{project}={auth_cookie}"
+            for _ in range(args.hub_requests):
+                await recorder.step("auth_validate", http, "/auth/validate", 200, headers={
+                    "x-original-url": f"https://{JUPYTER_HOST}/user/{username}/api/kernels",
+                    "x-forwarded-proto": "https",
+                    "cookie": cookie,
+                })
+
+        await recorder.step("logout", http, "/logout", 307)
+
+
+def percentiles(values):
+    if len(values) < 2:
+        value = values[0] if values else 0.0
+        return value, value, value
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+async def run_level(args, issuer, users):
+    """ Run `users` concurrent journeys against fresh fakes
+    """
+    loop = asyncio.get_running_loop()
+    projects = [f"project-{i}" for i in range(args.projects)]
+    usernames = [f"researcher-{i:04d}" for i in range(users)]
+
+    api = fakes.FakeCustomObjectsApi(latency=args.k8s_latency)
+    fakes.seed_identities(
+        api,
+        users={username: [f"group-{i % args.projects}"] for i, username in enumerate(usernames)},
+        groups={f"group-{i}": [project] for i, project in enumerate(projects)},
+        projects=projects,
+    )
+    keycloak = fakes.FakeKeycloak(issuer, latency=args.keycloak_latency, token_lifetime=args.token_lifetime)
+    guacamole = fakes.FakeGuacamole(latency=args.guacamole_latency)
+    fakes.install(api, issuer, informers=not args.no_informers)
+    fakes.install_upstreams(keycloak, guacamole)
+    controller = fakes.FakeVDIController(api, loop, boot_time=args.vdi_boot_time)
+    main.rdp_prober = fakes.FakeRDPProber(controller.rdp_hosts)
+    main.rdp_prober.start()
+    api.reset_calls()
+
+    recorder = Recorder()
+    journeys = [
+        researcher(recorder, args, username, f"project-{i % args.projects}", random.random() < args.vdi_fraction)
+        for i, username in enumerate(usernames)
+    ]
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(*journeys, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    await main.rdp_prober.stop()
+
+    unexpected = [o for o in outcomes if isinstance(o, Exception) and not isinstance(o, JourneyFailed)]
+    if unexpected:
+        raise unexpected[0]
+
+    steps = {}
+    for name, values in recorder.latencies.items():
+        p50, p95, p99 = percentiles(values)
+        steps[name] = {
+            "count": len(values),
+            "errors": recorder.errors[name],
+            "p50_ms": p50 * 1000,
+            "p95_ms": p95 * 1000,
+            "p99_ms": p99 * 1000,
+            "max_ms": max(values) * 1000,
+        }
+    for name, errors in recorder.errors.items():
+        steps.setdefault(name, {"count": 0, "errors": errors})
+
+    return {
+        "users": users,
+        "failed": sum(isinstance(o, JourneyFailed) for o in outcomes),
+        "elapsed_s": elapsed,
+        "steps": steps,
+        "per_journey": {
+            "k8s": api.total_calls / users,
+            "keycloak": keycloak.total_calls / users,
+            "guacamole": guacamole.total_calls / users,
+        },
+        "session_cookie_bytes": recorder.session_cookie_bytes,
+        "auth_cookie_bytes": recorder.auth_cookie_bytes,
+        "k8s_calls": dict(api.calls),
+        "keycloak_calls": dict(keycloak.calls),
+    }
+
+
+def report(results):
+    for result in results:
+        per_journey = result["per_journey"]
+        print(
+            f"\n{result['users']} researchers: {result['failed']} failed, {result['elapsed_s']:.1f}s, "
+            f"per journey k8s {per_journey['k8s']:.1f} keycloak {per_journey['keycloak']:.1f} "
+            f"guacamole {per_journey['guacamole']:.1f}, session cookie up to {result['session_cookie_bytes']} bytes, "
+            f"project auth cookie up to {result['auth_cookie_bytes']} bytes"
+        )
+        print(f"  {'step':<15} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for name, step in result["steps"].items():
+            if not step["count"]:
+                print(f"  {name:<15} {0:>6} {step['errors']:>6}")
+                continue
+            print(
+                f"  {name:<15} {step['count']:>6} {step['errors']:>6} {step['p50_ms']:>9.1f} "
+                f"{step['p95_ms']:>9.1f} {step['p99_ms']:>9.1f} {step['max_ms']:>9.1f}"
+            )
+
+
+async def run(args):
+    random.seed(args.seed)
+    issuer = fakes.LocalIssuer()
+    results = []
+    for users in args.users:
+        results.append(await run_level(args, issuer, users))
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 50, 100, 200], help="concurrent researchers, one run each")
+    parser.add_argument("--projects", type=int, default=4, help="projects the researchers are spread over")
+    parser.add_argument("--vdi-fraction", type=float, default=0.5, help="share of researchers launching a VDI instead of Jupyter")
+    parser.add_argument("--hub-requests", type=int, default=5, help="/auth/validate calls made by each Jupyter user")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which the researchers start")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between VDI status polls")
+    parser.add_argument("--ready-timeout", type=float, default=60.0, help="seconds to wait for a VDI to be ready")
+    parser.add_argument("--vdi-boot-time", type=float, default=3.0, help="seconds a fake VDI takes to come up")
+    parser.add_argument("--k8s-latency", type=float, default=0.005, help="seconds added to each fake Kubernetes call")
+    parser.add_argument("--keycloak-latency", type=float, default=0.02, help="seconds added to each fake Keycloak call")
+    parser.add_argument("--guacamole-latency", type=float, default=0.02, help="seconds added to each fake Guacamole call")
+    parser.add_argument("--token-lifetime", type=int, default=3600, help="access token lifetime, below 300 every launch refreshes")
+    parser.add_argument("--no-informers", action="store_true", help="leave the informers unsynced, reads go to the API")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
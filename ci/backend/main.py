@@ -1,22 +1,38 @@
 import os
 import re
+import sys
+import copy
+import uuid
+import queue
+import random
+import secrets
+import atexit
+import logging
+import logging.handlers
 import httpx
 import hmac
 import hashlib
 import jwt
 import time
 import asyncio
-import socket
+import contextvars
+import functools
+import inspect
+import ssl
+import threading
 import urllib.parse
 from urllib.parse import urlparse, parse_qs
 import json
 from base64 import standard_b64encode
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
 from authlib.integrations.starlette_client import OAuth
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, Depends, HTTPException, Header, Query
-from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, Response
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi import Path
 from fastapi.templating import Jinja2Templates
@@ -24,8 +40,22 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi import HTTPException as FastAPIHTTPException
 from jwt import PyJWKClient
 from starlette.middleware.sessions import SessionMiddleware
-from kubernetes import client, config
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import HTTPConnection
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+from kubernetes import client, config, watch
 from kubernetes.client.exceptions import ApiException
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from opentelemetry import propagate, trace
+from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
 
 
 # Load env variables
@@ -77,19 +107,404 @@ STATIC_RESOURCE_CONFIG = {
     "enabled": True
 }
 
+# Logging: levelled, JSON by default, with the request ID and trace of the
+# current request. Records are handed to a queue and written to stdout by a
+# listener thread so request handlers never block on the stream.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+# Per message type sampling, e.g. "auth.validate.denied=0.1,token.refreshed=0.5"
+LOG_SAMPLE_RATES = {
+    event.strip(): float(rate)
+    for event, _, rate in (
+        item.partition("=") for item in os.environ.get("LOG_SAMPLE_RATES", "").split(",") if "=" in item
+    )
+}
+request_id_var = contextvars.ContextVar("request_id", default=None)
+_LOG_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "event"}
+
+
+class RequestContextFilter(logging.Filter):
+    """ Sample records by their event type and stamp them with the request ID and
+        trace of the current request. Runs in the logging thread, before queueing.
+    """
+
+    def __init__(self, sample_rates=None):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        if event in self.sample_rates and random.random() >= self.sample_rates[event]:
+            return False
+        record.request_id = request_id_var.get()
+        span_context = trace.get_current_span().get_span_context()
+        if span_context.is_valid:
+            record.trace_id = format(span_context.trace_id, "032x")
+            record.span_id = format(span_context.span_id, "016x")
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """ One JSON object per line, with any extra= fields of the record
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("request_id", "event"):
+            if getattr(record, key, None):
+                entry[key] = getattr(record, key)
+        entry.update({key: value for key, value in vars(record).items() if key not in _LOG_RECORD_FIELDS})
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """ Format the message and traceback before queueing, keeping the traceback
+        apart from the message for the formatter
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _configure_logging():
+    """ Route the portal's logger through a queue to a stdout listener thread
+    """
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        formatter = JSONFormatter()
+        formatter.converter = time.gmtime
+    else:
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter(LOG_SAMPLE_RATES))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    portal_logger = logging.getLogger("k8tre.portal")
+    portal_logger.setLevel(LOG_LEVEL)
+    portal_logger.addHandler(queue_handler)
+    portal_logger.propagate = False
+    return portal_logger
+
+
+logger = _configure_logging()
+
+# Opt-in per-phase timing of the slow-path routes, returned in a Server-Timing
+# header and logged, e.g. "jwt;dur=1.2, authz;dur=0.3, total;dur=2.1"
+SERVER_TIMING_ENABLED = os.environ.get("K8TRE_SERVER_TIMING", "false").lower() == "true"
+SERVER_TIMING_ROUTES = {
+    "/auth/validate",
+    "/auth/sso",
+    "/launch/{project}/{app}",
+    "/api/vdi/connect/{username}/{project}",
+}
+request_timings_var = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def _timed(phase):
+    """ Add the duration of a phase to the current request's timing breakdown.
+        Repeated phases add up, nested phases are each reported in full.
+    """
+    timings = request_timings_var.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+
+
+def _server_timing_header(timings):
+    return ", ".join(f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in timings.items())
+
+# Prometheus metrics, served on /metrics
+REQUEST_LATENCY = Histogram(
+    "k8tre_portal_request_duration_seconds", "Latency of portal requests by route",
+    ["method", "route", "status"]
+)
+K8S_API_LATENCY = Histogram(
+    "k8tre_portal_k8s_api_duration_seconds", "Latency of Kubernetes API calls by verb and resource",
+    ["verb", "resource", "code"]
+)
+UPSTREAM_LATENCY = Histogram(
+    "k8tre_portal_upstream_duration_seconds", "Latency of Keycloak and Guacamole calls",
+    ["service", "method", "status"]
+)
+AUTH_VALIDATE_OUTCOMES = Counter(
+    "k8tre_portal_auth_validate_total", "Outcomes of /auth/validate (200, 401, 403 or static)",
+    ["outcome"]
+)
+CACHE_LOOKUPS = Counter(
+    "k8tre_portal_cache_lookups_total", "Lookups of internal caches and indexes",
+    ["cache", "result"]
+)
+TOKEN_REFRESHES = Counter(
+    "k8tre_portal_token_refreshes_total", "Keycloak token refreshes (refreshed or failed) and refreshes avoided (coalesced or reused)",
+    ["outcome"]
+)
+USER_SESSIONS_ENDED = Counter(
+    "k8tre_portal_user_sessions_ended_total", "Users dropped from the active session registry (logout or expired)",
+    ["reason"]
+)
+
+
+def _record_cache_lookup(cache, hit):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+# Tracing, exported over OTLP (OTEL_EXPORTER_OTLP_ENDPOINT) when enabled. Unless
+# OTEL_TRACES_SAMPLER is set, a ratio of new traces is sampled and the caller's
+# decision is followed for propagated ones.
+TRACING_ENABLED = os.environ.get("K8TRE_TRACING", "false").lower() == "true"
+TRACING_SAMPLE_RATIO = float(os.environ.get("OTEL_TRACES_SAMPLER_ARG", "0.1"))
+tracer = trace.get_tracer("k8tre-portal")
+tracer_provider = None
+
+
+def _setup_tracing(app):
+    """ Install the OTLP tracer provider and instrument FastAPI and httpx
+    """
+    global tracer_provider
+    sampler = None
+    if "OTEL_TRACES_SAMPLER" not in os.environ:
+        sampler = ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO))
+    tracer_provider = TracerProvider(
+        resource=Resource.create({"service.name": os.environ.get("OTEL_SERVICE_NAME", "k8tre-portal")}),
+        sampler=sampler,
+    )
+    tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(tracer_provider)
+    FastAPIInstrumentor.instrument_app(app, excluded_urls="health,metrics")
+    HTTPXClientInstrumentor().instrument()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """ Start and stop the process-wide background workers (key refresh etc.)
+    """
+    jwks_cache.start()
+    rdp_prober.start()
+    if TOKEN_REFRESH_SCHEDULER_ENABLED:
+        token_refresher.start()
+    active_user_sessions.start()
+    threading.Thread(target=_label_legacy_vdi_instances, name="vdi-labels", daemon=True).start()
+    if CR_CACHE_ENABLED:
+        for informer in (*cr_informers.values(), *vdi_informers.values()):
+            informer.start()
+    yield
+    for informer in (*cr_informers.values(), *vdi_informers.values()):
+        informer.stop()
+    jwks_cache.stop()
+    await rdp_prober.stop()
+    await token_refresher.stop()
+    await active_user_sessions.stop()
+    k8s_executor.shutdown(wait=False)
+    await asyncio.gather(*(http.aclose() for http in http_clients.values()))
+    http_clients.clear()
+    if session_store is not None:
+        await session_store.close()
+    if tracer_provider:
+        tracer_provider.shutdown()
+
+
+# Login sessions are kept in the signed k8tre-session cookie by default ("cookie").
+# With "memory" or "redis" the cookie only holds an opaque session ID and the session
+# is kept server side, in this process or in Redis (needed for more than one replica).
+SESSION_STORE = os.environ.get("SESSION_STORE", "cookie").lower()
+SESSION_MAX_AGE = int(os.environ.get("SESSION_MAX_AGE", str(86400 * 2)))
+SESSION_STORE_MAX_SESSIONS = int(os.environ.get("SESSION_STORE_MAX_SESSIONS", "10000"))
+SESSION_REDIS_URL = os.environ.get("SESSION_REDIS_URL", "redis://localhost:6379/0")
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{43}$")
+
+
+class MemorySessionStore:
+    """ Sessions held as JSON in process memory. Each expires ttl seconds after it was
+        last used and the least recently used are dropped beyond maxsize.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    async def load(self, session_id):
+        entry = self._data.get(session_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._data[session_id]
+            return None
+        self._data[session_id] = (time.time() + self.ttl, entry[1])
+        self._data.move_to_end(session_id)
+        return entry[1]
+
+    async def save(self, session_id, data):
+        self._data[session_id] = (time.time() + self.ttl, data)
+        self._data.move_to_end(session_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def delete(self, session_id):
+        self._data.pop(session_id, None)
+
+    async def close(self):
+        pass
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisSessionStore:
+    """ Sessions held as JSON in Redis, or anything speaking its protocol, under
+        prefix + session ID. Each expires about ttl seconds after it was last used:
+        loading only reads, the expiry is pushed back once a tenth of it has passed.
+    """
+
+    def __init__(self, redis, ttl, prefix="k8tre:session:"):
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
 
-app = FastAPI()
+    async def load(self, session_id):
+        key = self.prefix + session_id
+        async with self.redis.pipeline(transaction=False) as pipe:
+            data, remaining = await pipe.get(key).ttl(key).execute()
+        if data is not None and 0 <= remaining < self.ttl - self.ttl // 10:
+            await self.redis.expire(key, self.ttl)
+        return data.decode() if isinstance(data, bytes) else data
+
+    async def save(self, session_id, data):
+        await self.redis.set(self.prefix + session_id, data, ex=self.ttl)
+
+    async def delete(self, session_id):
+        await self.redis.delete(self.prefix + session_id)
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+class ServerSideSessionMiddleware:
+    """ SessionMiddleware keeping request.session in a session store, the cookie only
+        holds a random session ID.
+
+        A session is written back only when the request changed it, and is given a new
+        ID when its user changes (login) so that an ID set before login is worthless
+        afterwards. IDs the store does not know are never adopted. While Redis is
+        unavailable requests go ahead without a session and nothing is written back.
+    """
+
+    def __init__(self, app, store, session_cookie="session", max_age=14 * 24 * 60 * 60,
+                 path="/", same_site="lax", https_only=False):
+        self.app = app
+        self.store = store
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.path = path
+        self.security_flags = "httponly; samesite=" + same_site
+        if https_only:
+            self.security_flags += "; secure"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        session_id = HTTPConnection(scope).cookies.get(self.session_cookie)
+        stored = None
+        if session_id and SESSION_ID_PATTERN.match(session_id):
+            try:
+                stored = await self.store.load(session_id)
+            except RedisError as e:
+                logger.warning("Session store unavailable, handling request without a session: %s", e)
+        scope["session"] = json.loads(stored) if stored else {}
+        user = scope["session"].get("user")
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                try:
+                    cookie = await self._write_back(scope["session"], session_id, stored, user)
+                except RedisError as e:
+                    logger.warning("Session store unavailable, session not saved: %s", e)
+                    cookie = None
+                if cookie:
+                    MutableHeaders(scope=message).append("Set-Cookie", f"{self.session_cookie}={cookie}")
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _write_back(self, session, session_id, stored, user):
+        """ Save or delete the session as needed, returning the cookie to set (if any)
+        """
+        if session:
+            data = json.dumps(session)
+            if stored is None or session.get("user") != user:
+                if stored is not None:
+                    await self.store.delete(session_id)
+                session_id = secrets.token_urlsafe(32)
+                await self.store.save(session_id, data)
+            elif data != stored:
+                await self.store.save(session_id, data)
+            return f"{session_id}; path={self.path}; Max-Age={self.max_age}; {self.security_flags}"
+        if stored is not None:
+            # The session has been cleared
+            await self.store.delete(session_id)
+            return f"null; path={self.path}; expires=Thu, 01 Jan 1970 00:00:00 GMT; {self.security_flags}"
+        return None
+
+
+def _create_session_store():
+    if SESSION_STORE == "cookie":
+        return None
+    if SESSION_STORE == "memory":
+        return MemorySessionStore(SESSION_STORE_MAX_SESSIONS, SESSION_MAX_AGE)
+    if SESSION_STORE == "redis":
+        return RedisSessionStore(aioredis.from_url(SESSION_REDIS_URL), SESSION_MAX_AGE)
+    raise ValueError(f"Unknown SESSION_STORE {SESSION_STORE!r}, expected cookie, memory or redis")
+
+
+session_store = _create_session_store()
+
+app = FastAPI(lifespan=lifespan)
 
 # login sessions
 # temp for http
-app.add_middleware(
-    SessionMiddleware,
-    secret_key=os.environ.get("SESSION_SECRET", "dev-secret-key"),
-    session_cookie="k8tre-session",
-    same_site="lax",
-    https_only=False,
-    max_age=86400 * 2
-)
+if session_store is None:
+    app.add_middleware(
+        SessionMiddleware,
+        secret_key=os.environ.get("SESSION_SECRET", "dev-secret-key"),
+        session_cookie="k8tre-session",
+        same_site="lax",
+        https_only=False,
+        max_age=SESSION_MAX_AGE
+    )
+else:
+    app.add_middleware(
+        ServerSideSessionMiddleware,
+        store=session_store,
+        session_cookie="k8tre-session",
+        same_site="lax",
+        https_only=False,
+        max_age=SESSION_MAX_AGE
+    )
 # Will update once we confirm from the Azure App gateway integration using env
 app.add_middleware(
     CORSMiddleware,
@@ -101,6 +516,70 @@ app.add_middleware(
     allow_methods=["GET", "POST", "OPTIONS"],
     allow_headers=["*"],
 )
+
+
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+class RequestContextMiddleware:
+    """ Assign each request an ID for the logs (the caller's X-Request-ID if it is
+        sane) and observe its latency, labelled by route template. With Server-Timing
+        on, the slow-path routes get their phase breakdown added to the response.
+
+        Plain ASGI rather than @app.middleware("http"), so requests do not run in an
+        extra task behind memory streams and handler exceptions propagate unchanged.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = Headers(scope=scope).get("x-request-id", "")
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        request_id_var.set(request_id)
+        timings = {} if SERVER_TIMING_ENABLED else None
+        request_timings_var.set(timings)
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers["X-Request-ID"] = request_id
+                route = scope.get("route")
+                if timings is not None and route and route.path in SERVER_TIMING_ROUTES:
+                    timings["total"] = time.perf_counter() - start
+                    headers["Server-Timing"] = _server_timing_header(timings)
+                    logger.info(
+                        "Timing of %s: %s", route.path, headers["Server-Timing"],
+                        extra={"event": "server_timing", "route": route.path,
+                               "timings_ms": {phase: round(seconds * 1000, 1) for phase, seconds in timings.items()}}
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"], route.path if route else "unmatched", str(status)
+            ).observe(time.perf_counter() - start)
+
+
+app.add_middleware(RequestContextMiddleware)
+
+
+if TRACING_ENABLED:
+    _setup_tracing(app)
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
@@ -116,6 +595,163 @@ keycloak_realm = os.environ.get("KEYCLOAK_REALM", "k8tre-app")
 internal_base = f"{keycloak_internal_url}/realms/{keycloak_realm}"
 external_base = f"{keycloak_external_url}/realms/{keycloak_realm}"
 jwks_url = f"{keycloak_internal_url}/realms/{keycloak_realm}/protocol/openid-connect/certs"
+JWKS_REFRESH_INTERVAL = int(os.environ.get("JWKS_REFRESH_INTERVAL", "300"))
+JWKS_MIN_REFETCH_INTERVAL = int(os.environ.get("JWKS_MIN_REFETCH_INTERVAL", "10"))
+
+
+class JWKSCache:
+    """ Process-wide store of the Keycloak realm signing keys, indexed by kid.
+
+        Keys are refreshed by a background thread every `refresh_interval` seconds,
+        so verifying a token is CPU only and never waits on Keycloak. An unknown kid
+        fails its token and wakes the thread for an early refetch (at most every
+        `min_refetch_interval` seconds) so that key rotation is still picked up.
+    """
+
+    def __init__(self, url, refresh_interval=300, min_refetch_interval=10):
+        ssl_context = ssl.create_default_context()
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+
+        self.refresh_interval = refresh_interval
+        self.min_refetch_interval = min_refetch_interval
+        self._client = PyJWKClient(url, cache_jwk_set=False, ssl_context=ssl_context)
+        self._keys = {}
+        self._last_fetch = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """ Fetch the JWKS and atomically replace the cached keys.
+        """
+        with self._lock:
+            self._last_fetch = time.monotonic()
+        start = time.perf_counter()
+        status = "error"
+        try:
+            with tracer.start_as_current_span("jwks.fetch"):
+                signing_keys = self._client.get_signing_keys(refresh=True)
+            status = "200"
+        finally:
+            UPSTREAM_LATENCY.labels("keycloak", "GET", status).observe(time.perf_counter() - start)
+        keys = {key.key_id: key for key in signing_keys}
+        with self._lock:
+            self._keys = keys
+        return keys
+
+    def get_signing_key(self, kid):
+        """ Return the cached signing key for kid. An unknown kid raises and asks the
+            background thread to refetch, the request itself never fetches.
+        """
+        key = self._keys.get(kid)
+        _record_cache_lookup("jwks", key is not None)
+        if key is not None:
+            return key
+
+        with self._lock:
+            refetch = time.monotonic() - self._last_fetch >= self.min_refetch_interval
+        if refetch and not self._wake.is_set():
+            logger.info("Unknown signing key %s, refetching JWKS", kid)
+            self._wake.set()
+        raise jwt.PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("JWKS refresh failed: %s", e)
+            self._wake.wait(self.refresh_interval)
+
+    def start(self):
+        """ Start the background refresh thread
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="jwks-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the background refresh thread
+        """
+        self._stop.set()
+        self._wake.set()
+
+
+jwks_cache = JWKSCache(jwks_url, JWKS_REFRESH_INTERVAL, JWKS_MIN_REFETCH_INTERVAL)
+
+
+class TTLCache:
+    """ Bounded, thread-safe LRU cache whose entries expire after a TTL.
+
+        An entry can be given an absolute expiry (epoch seconds, e.g. a token's exp)
+        in which case it expires at whichever of that and the TTL comes first.
+        Named caches count their hits and misses and report their size in metrics.
+    """
+
+    instances = {}
+
+    def __init__(self, maxsize=1024, ttl=60, name=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        if name:
+            TTLCache.instances[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= time.time():
+                del self._data[key]
+                entry = None
+            if entry is not None:
+                self._data.move_to_end(key)
+        if self.name:
+            _record_cache_lookup(self.name, entry is not None)
+        return default if entry is None else entry[1]
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        expiry = time.time() + (self.ttl if ttl is None else ttl)
+        if expires_at is not None:
+            expiry = min(expiry, expires_at)
+        with self._lock:
+            self._data[key] = (expiry, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def expire(self):
+        """ Drop expired entries now rather than when they are next looked up or
+            evicted, returning how many were dropped
+        """
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (expiry, _) in self._data.items() if expiry <= now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+    def __len__(self):
+        return len(self._data)
 
 oauth.register(
     name='keycloak',
@@ -142,43 +778,687 @@ try:
     config.load_incluster_config()
 except Exception:
     config.load_kube_config()
-k8s_api = client.CustomObjectsApi()
-k8s_auth_api = client.AuthenticationV1Api()
+
+# Blocking Kubernetes client calls made from async handlers run on this bounded
+# executor instead of the event loop
+K8S_EXECUTOR_WORKERS = int(os.environ.get("K8S_EXECUTOR_WORKERS", "16"))
+k8s_executor = ThreadPoolExecutor(max_workers=K8S_EXECUTOR_WORKERS, thread_name_prefix="k8s")
+
+k8s_config = client.Configuration.get_default_copy()
+# One connection per executor worker plus headroom for the informer watches
+k8s_config.connection_pool_maxsize = K8S_EXECUTOR_WORKERS + 8
+k8s_api_client = client.ApiClient(k8s_config)
+
+
+def _k8s_request_labels(method, url, query):
+    """ (verb, resource) of a Kubernetes API request, e.g. ("list", "vdiinstances")
+    """
+    segments = urlparse(url).path.strip("/").split("/")
+    # /api/v1/... or /apis/{group}/{version}/...
+    segments = segments[2:] if segments[0] == "api" else segments[3:]
+    if len(segments) > 2 and segments[0] == "namespaces":
+        segments = segments[2:]
+    resource = segments[0] if segments else "unknown"
+    named = len(segments) > 1
+    if method == "GET":
+        if "watch=true" in query.lower():
+            return "watch", resource
+        return ("get" if named else "list"), resource
+    verbs = {"POST": "create", "PUT": "update", "PATCH": "patch", "DELETE": "delete"}
+    return verbs.get(method, method.lower()), resource
+
+
+def _instrument_k8s_client(api_client):
+    """ Observe the latency of every request made by a Kubernetes API client
+    """
+    request = api_client.rest_client.request
+
+    @functools.wraps(request)
+    def timed_request(method, url, *args, **kwargs):
+        query = urlparse(url).query + urllib.parse.urlencode(kwargs.get("query_params") or [])
+        verb, resource = _k8s_request_labels(method, url, query)
+        start = time.perf_counter()
+        code = "error"
+        try:
+            if verb == "watch":
+                response = request(method, url, *args, **kwargs)
+            else:
+                with tracer.start_as_current_span(
+                    f"k8s {verb} {resource}", kind=trace.SpanKind.CLIENT,
+                    attributes={"http.request.method": method, "k8s.resource": resource}
+                ), _timed("k8s"):
+                    response = request(method, url, *args, **kwargs)
+            code = str(response.status)
+            return response
+        except ApiException as e:
+            code = str(e.status)
+            raise
+        finally:
+            K8S_API_LATENCY.labels(verb, resource, code).observe(time.perf_counter() - start)
+
+    api_client.rest_client.request = timed_request
+
+
+_instrument_k8s_client(k8s_api_client)
+
+
+class _InflightRead:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _coalesced_read(name):
+    method = getattr(client.CustomObjectsApi, name)
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def read(self, *args, **kwargs):
+        return self._coalesce(name, signature, args, kwargs)
+    return read
+
+
+class CoalescingCustomObjectsApi:
+    """ Wraps a CustomObjectsApi so identical concurrent reads share one API call.
+
+        A GET or LIST that arrives while the same read (group, version, namespace,
+        plural, name and options) is in flight waits for it and gets a copy of its
+        result, or its exception, instead of calling the API server itself. Watches
+        and raw (_preload_content=False) reads are never shared, other calls are
+        passed straight through.
+    """
+
+    def __init__(self, api):
+        self._api = api
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def __getattr__(self, name):
+        return getattr(self._api, name)
+
+    def _coalesce(self, name, signature, args, kwargs):
+        call = getattr(self._api, name)
+        if kwargs.get("watch") or kwargs.get("_preload_content") is False:
+            return call(*args, **kwargs)
+
+        bound = signature.bind(self._api, *args, **kwargs)
+        key = (name, *(
+            (param, value) for param, value in bound.arguments.items() if param != "self"
+        ))
+        try:
+            hash(key)
+        except TypeError:
+            return call(*args, **kwargs)
+
+        with self._lock:
+            read = self._inflight.get(key)
+            leader = read is None
+            if leader:
+                read = self._inflight[key] = _InflightRead()
+        _record_cache_lookup("k8s_inflight_reads", not leader)
+
+        if leader:
+            try:
+                read.result = call(*args, **kwargs)
+                return read.result
+            except Exception as e:
+                read.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+                read.done.set()
+
+        read.done.wait()
+        if read.error is not None:
+            raise read.error
+        # Callers may modify what they get back, the leader has the original
+        return copy.deepcopy(read.result)
+
+    get_namespaced_custom_object = _coalesced_read("get_namespaced_custom_object")
+    list_namespaced_custom_object = _coalesced_read("list_namespaced_custom_object")
+    list_cluster_custom_object = _coalesced_read("list_cluster_custom_object")
+
+
+k8s_api = CoalescingCustomObjectsApi(client.CustomObjectsApi(k8s_api_client))
+k8s_auth_api = client.AuthenticationV1Api(k8s_api_client)
+k8s_core_api = client.CoreV1Api(k8s_api_client)
+k8s_discovery_api = client.DiscoveryV1Api(k8s_api_client)
+
+
+async def _run_k8s(func, *args, **kwargs):
+    """ Run a blocking Kubernetes call on the k8s executor and await its result
+    """
+    loop = asyncio.get_running_loop()
+    # Carry the current trace context over to the worker thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(k8s_executor, functools.partial(context.run, func, *args, **kwargs))
 
 # Service accounts allowed to call /internal/* endpoints
 ALLOWED_INTERNAL_SAS = {
     "system:serviceaccount:jupyterhub:hub",
 }
 
-def verify_internal_token(authorization=Header(None)):
-    """ Verify K8s SA token for internal endpoints
-    """
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid authorisation header")
+# Service accounts allowed to scrape /metrics
+METRICS_ALLOWED_SAS = set(os.environ.get(
+    "METRICS_ALLOWED_SAS", "system:serviceaccount:observability:prometheus-community-kube-prometheus"
+).split(","))
 
-    token = authorization.removeprefix("Bearer ").strip()
+TOKEN_REVIEW_CACHE_TTL = int(os.environ.get("TOKEN_REVIEW_CACHE_TTL", "300"))
+TOKEN_REVIEW_NEGATIVE_TTL = int(os.environ.get("TOKEN_REVIEW_NEGATIVE_TTL", "5"))
+token_reviews = TTLCache(1024, TOKEN_REVIEW_CACHE_TTL, name="token_reviews")
+
+
+def _review_token(token):
+    """ TokenReview a service account token, returning its identity or raising
+        HTTPException if it is not authenticated.
+    """
     try:
         review = client.V1TokenReview(
             spec=client.V1TokenReviewSpec(token=token)
         )
-        result = k8s_auth_api.create_token_review(review)
+        with tracer.start_as_current_span("k8s.token_review") as span:
+            result = k8s_auth_api.create_token_review(review)
+            span.set_attribute("k8tre.authenticated", bool(result.status.authenticated))
         if not result.status.authenticated:
             raise HTTPException(status_code=401, detail="Token not authenticated")
-
-        sa_identity = result.status.user.username
-        if sa_identity not in ALLOWED_INTERNAL_SAS:
-            print(f"Rejected internal API call from: {sa_identity}", flush=True)
-            raise HTTPException(status_code=403, detail="Service account not authorised")
+        return result.status.user.username
     except HTTPException:
         raise
     except Exception as e:
-        print(f"TokenReview failed: {e}", flush=True)
+        logger.warning("TokenReview failed: %s", e)
         raise HTTPException(status_code=401, detail="Token verification failed")
 
-active_user_sessions = {}
+
+def _verify_service_account(authorization, allowed_sas):
+    """ Verify a K8s SA bearer token belongs to one of allowed_sas.
+        Reviews are cached by token hash: identities until the cache TTL or the
+        token's own expiry, whichever is first, and failures for a few seconds.
+    """
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing or invalid authorisation header")
+
+    token = authorization.removeprefix("Bearer ").strip()
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    sa_identity = token_reviews.get(token_hash)
+    if isinstance(sa_identity, HTTPException):
+        raise sa_identity
+
+    if sa_identity is None:
+        try:
+            sa_identity = _review_token(token)
+        except HTTPException as e:
+            token_reviews.set(token_hash, e, ttl=TOKEN_REVIEW_NEGATIVE_TTL)
+            raise
+
+        try:
+            # Bound service account tokens are JWTs, do not cache them beyond their expiry
+            expires_at = jwt.decode(token, options={"verify_signature": False}).get("exp")
+        except Exception:
+            expires_at = None
+        token_reviews.set(token_hash, sa_identity, expires_at=expires_at)
+
+    if sa_identity not in allowed_sas:
+        logger.warning("Rejected internal API call from: %s", sa_identity)
+        raise HTTPException(status_code=403, detail="Service account not authorised")
+
+
+def verify_internal_token(authorization=Header(None)):
+    """ Verify K8s SA token for internal endpoints
+    """
+    _verify_service_account(authorization, ALLOWED_INTERNAL_SAS)
+
+
+def verify_metrics_token(authorization=Header(None)):
+    """ Verify K8s SA token of the Prometheus scraping /metrics
+    """
+    _verify_service_account(authorization, METRICS_ALLOWED_SAS)
+
+# Active user sessions are kept for a session cookie's lifetime, then swept
+USER_SESSION_REGISTRY_SIZE = int(os.environ.get("USER_SESSION_REGISTRY_SIZE", "10000"))
+USER_SESSION_SWEEP_INTERVAL = float(os.environ.get("USER_SESSION_SWEEP_INTERVAL", "300"))
+
+
+class SessionRegistry:
+    """ Tokens of each logged in user, for revoking them when JupyterHub logs out.
+
+        Holds the latest login of at most maxsize users, dropping the least recently
+        logged in beyond that, and forgets a login ttl seconds after it was made.
+        When started, expired logins are swept every sweep_interval seconds so their
+        refresh tokens are not kept in memory until the next lookup.
+    """
+
+    def __init__(self, maxsize, ttl, sweep_interval):
+        self.sweep_interval = sweep_interval
+        self._sessions = TTLCache(maxsize, ttl, name="active_user_sessions")
+        self._task = None
+
+    def add(self, username, token, refresh_token, session_id):
+        """ Record a user's login, replacing any earlier one
+        """
+        self._sessions.set(username, {
+            "token": token,
+            "refresh_token": refresh_token,
+            "session_id": session_id,
+        })
+
+    def get(self, username):
+        """ Get the user's {token, refresh_token, session_id}, None if not logged in
+        """
+        return self._sessions.get(username)
+
+    def end(self, username):
+        """ Drop the user's login, returning it (None if there was none)
+        """
+        session = self._sessions.pop(username)
+        if session is not None:
+            USER_SESSIONS_ENDED.labels("ended").inc()
+        return session
+
+    def sweep(self):
+        """ Drop expired logins now, returning how many there were
+        """
+        expired = self._sessions.expire()
+        if expired:
+            USER_SESSIONS_ENDED.labels("expired").inc(expired)
+            logger.debug("Swept %d expired user sessions", expired)
+        return expired
+
+    def clear(self):
+        self._sessions.clear()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning("User session sweep failed: %s", e)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+active_user_sessions = SessionRegistry(USER_SESSION_REGISTRY_SIZE, SESSION_MAX_AGE, USER_SESSION_SWEEP_INTERVAL)
+
+# Local cache of identity and research custom resources
+CR_CACHE_ENABLED = os.environ.get("K8TRE_CR_CACHE", "true").lower() == "true"
+CR_WATCH_TIMEOUT = int(os.environ.get("K8TRE_CR_WATCH_TIMEOUT", "300"))
+CR_KINDS = {
+    "users": ("identity.k8tre.io", "v1alpha1"),
+    "groups": ("identity.k8tre.io", "v1alpha1"),
+    "projects": ("research.k8tre.io", "v1alpha1"),
+}
+
+
+class ResourceInformer:
+    """ In-memory copy of a set of Kubernetes objects kept current by list + watch.
+
+        The initial list gives a resourceVersion that the watch resumes from, bookmarks
+        keep it fresh between changes and a 410 Gone (expired resourceVersion) triggers
+        a full relist. Objects are stored as raw dicts keyed by (namespace, name) and
+        must be treated as read-only by callers. If given, only objects for which
+        include(obj) is true are kept, for selections a label selector cannot express.
+    """
+
+    def __init__(self, kind, list_func, *args, namespace=None, watch_timeout=300, include=None, **kwargs):
+        self.kind = kind
+        self.namespace = namespace
+        self.watch_timeout = watch_timeout
+        self.include = include
+        self._list_func = list_func
+        self._args = args
+        self._kwargs = kwargs
+        self._items = {}
+        self._handlers = []
+        self._resource_version = None
+        self._synced = threading.Event()
+        self._stop = threading.Event()
+        self._watch = None
+        self._thread = None
+
+    @property
+    def synced(self):
+        return self._synced.is_set()
+
+    def wait_for_sync(self, timeout=None):
+        return self._synced.wait(timeout)
+
+    def add_handler(self, handler):
+        """ Register handler(event_type, obj), called for every ADDED, MODIFIED and
+            DELETED object. A relist is replayed as DELETED/ADDED events.
+        """
+        self._handlers.append(handler)
+
+    def _notify(self, event_type, obj):
+        for handler in self._handlers:
+            try:
+                handler(event_type, obj)
+            except Exception:
+                logger.exception("Informer %s: handler failed on %s", self.kind, event_type)
+
+    @staticmethod
+    def _key(obj):
+        metadata = obj.get("metadata", {})
+        return metadata.get("namespace"), metadata.get("name")
+
+    def get(self, name, namespace=None):
+        """ Get a cached object by name, None if it does not exist.
+        """
+        return self._items.get((namespace or self.namespace, name))
+
+    def list(self):
+        """ All cached objects
+        """
+        return list(self._items.values())
+
+    def _relist(self):
+        resp = self._list_func(*self._args, _preload_content=False, **self._kwargs)
+        result = json.loads(resp.data)
+        items = {
+            self._key(obj): obj for obj in result.get("items", [])
+            if self.include is None or self.include(obj)
+        }
+        previous, self._items = self._items, items
+        for key, obj in previous.items():
+            if key not in items:
+                self._notify("DELETED", obj)
+        for obj in items.values():
+            self._notify("ADDED", obj)
+        self._resource_version = result["metadata"]["resourceVersion"]
+        self._synced.set()
+        logger.info("Informer %s: listed %d objects at %s", self.kind, len(self._items), self._resource_version)
+
+    def _apply(self, event_type, obj):
+        key = self._key(obj)
+        if self.include is not None and not self.include(obj):
+            if key not in self._items:
+                return
+            event_type = "DELETED"
+        if event_type == "DELETED":
+            self._items.pop(key, None)
+        else:
+            self._items[key] = obj
+        self._notify(event_type, obj)
+
+    def _watch_once(self):
+        self._watch = watch.Watch()
+        stream = self._watch.stream(
+            self._list_func, *self._args,
+            resource_version=self._resource_version,
+            allow_watch_bookmarks=True,
+            timeout_seconds=self.watch_timeout,
+            **self._kwargs
+        )
+        for event in stream:
+            obj = event["raw_object"]
+            if event["type"] == "ERROR":
+                raise ApiException(status=obj.get("code"), reason=obj.get("message"))
+
+            self._resource_version = obj["metadata"]["resourceVersion"]
+            if event["type"] != "BOOKMARK":
+                self._apply(event["type"], obj)
+
+    def _run(self):
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                if self._resource_version is None:
+                    self._relist()
+                self._watch_once()
+                backoff = 1
+            except ApiException as e:
+                if e.status == 410:
+                    logger.info("Informer %s: resourceVersion expired, relisting", self.kind)
+                    self._resource_version = None
+                    continue
+                logger.warning("Informer %s: watch failed: %s %s", self.kind, e.status, e.reason)
+            except Exception as e:
+                logger.warning("Informer %s: watch failed: %s", self.kind, e)
+            else:
+                continue
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def start(self):
+        """ Start the list/watch thread
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"informer-{self.kind}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the list/watch thread
+        """
+        self._stop.set()
+        if self._watch:
+            self._watch.stop()
+
+
+cr_informers = {
+    plural: ResourceInformer(
+        plural, k8s_api.list_namespaced_custom_object, group, version, NAMESPACE, plural,
+        namespace=NAMESPACE, watch_timeout=CR_WATCH_TIMEOUT
+    )
+    for plural, (group, version) in CR_KINDS.items()
+}
+
+
+ENTITLEMENT_NEGATIVE_TTL = int(os.environ.get("ENTITLEMENT_NEGATIVE_TTL", "30"))
+
+
+class EntitlementIndex:
+    """ Derived index of username -> projects, built from User and Group CRs.
+
+        Behind it sit user -> groups, group -> projects and the inverted group -> users
+        index, so a change to one Group only recomputes its members. It is fed by
+        the users/groups informers and is authoritative once both have synced; until
+        then callers walk the CRs and record unknown users as short-lived negative
+        entries.
+    """
+
+    def __init__(self, negative_ttl=30):
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._user_groups = {}
+        self._group_projects = {}
+        self._group_users = {}
+        self._user_projects = {}
+        self._versions = {}
+        self._negative = {}
+
+    @property
+    def ready(self):
+        return cr_informers["users"].synced and cr_informers["groups"].synced
+
+    def _recompute(self, username):
+        projects = set()
+        for group_name in self._user_groups.get(username, ()):
+            projects.update(self._group_projects.get(group_name, ()))
+        projects = frozenset(projects)
+        if self._user_projects.get(username) != projects:
+            self._user_projects[username] = projects
+            self._versions[username] = self._versions.get(username, 0) + 1
+
+    def on_user_event(self, event_type, obj):
+        username = obj["metadata"]["name"]
+        with self._lock:
+            for group_name in self._user_groups.pop(username, ()):
+                members = self._group_users.get(group_name, set())
+                members.discard(username)
+                if not members:
+                    self._group_users.pop(group_name, None)
+
+            if event_type == "DELETED":
+                self._user_projects.pop(username, None)
+                self._versions[username] = self._versions.get(username, 0) + 1
+                return
+
+            groups = frozenset((obj.get("spec") or {}).get("groups", []) or [])
+            self._user_groups[username] = groups
+            for group_name in groups:
+                self._group_users.setdefault(group_name, set()).add(username)
+            self._negative.pop(username, None)
+            self._recompute(username)
+
+    def on_group_event(self, event_type, obj):
+        group_name = obj["metadata"]["name"]
+        with self._lock:
+            if event_type == "DELETED":
+                self._group_projects.pop(group_name, None)
+            else:
+                projects = (obj.get("spec") or {}).get("projects", []) or []
+                self._group_projects[group_name] = frozenset(projects)
+
+            for username in self._group_users.get(group_name, ()):
+                self._recompute(username)
+
+    def lookup(self, username):
+        """ Projects the user can access, None if the user does not exist.
+        """
+        return self._user_projects.get(username)
+
+    def version(self, username):
+        """ Counter that changes whenever the user's projects change
+        """
+        return self._versions.get(username, 0)
+
+    def is_negative(self, username):
+        expiry = self._negative.get(username)
+        return expiry is not None and expiry > time.monotonic()
+
+    def add_negative(self, username):
+        now = time.monotonic()
+        if len(self._negative) > 1024:
+            self._negative = {u: exp for u, exp in self._negative.items() if exp > now}
+        self._negative[username] = now + self.negative_ttl
+
+
+entitlements = EntitlementIndex(ENTITLEMENT_NEGATIVE_TTL)
+cr_informers["users"].add_handler(entitlements.on_user_event)
+cr_informers["groups"].add_handler(entitlements.on_group_event)
+
+
+def _get_cr(plural, name):
+    """ Get a User, Group or Project CR, from the local cache once it is synced
+    """
+    informer = cr_informers[plural]
+    _record_cache_lookup("cr_informer", informer.synced)
+    with tracer.start_as_current_span(f"get_cr {plural}") as span, _timed("cr"):
+        span.set_attribute("k8tre.cr.name", name)
+        span.set_attribute("k8tre.cr.source", "informer" if informer.synced else "api")
+        if informer.synced:
+            obj = informer.get(name)
+            if obj is None:
+                raise ApiException(status=404, reason=f"{plural} {name} not found")
+            return obj
+
+        group, version = CR_KINDS[plural]
+        return k8s_api.get_namespaced_custom_object(group, version, NAMESPACE, plural, name)
+
+
+def _list_crs(plural):
+    """ List all User, Group or Project CRs, from the local cache once it is synced
+    """
+    informer = cr_informers[plural]
+    if informer.synced:
+        return informer.list()
+
+    group, version = CR_KINDS[plural]
+    return k8s_api.list_namespaced_custom_object(group, version, NAMESPACE, plural).get("items", [])
+
+
+def _get_user_projects(username):
+    """ Get the set of projects a user can access through their groups.
+        Raises ApiException (404) if the user does not exist.
+    """
+    _record_cache_lookup("entitlements", entitlements.ready)
+    if entitlements.ready:
+        projects = entitlements.lookup(username)
+        if projects is None:
+            raise ApiException(status=404, reason=f"users {username} not found")
+        return projects
+
+    if entitlements.is_negative(username):
+        raise ApiException(status=404, reason=f"users {username} not found")
+    try:
+        user_cr = _get_cr("users", username)
+    except ApiException as e:
+        if e.status == 404:
+            entitlements.add_negative(username)
+        raise
+
+    projects = set()
+    for group_name in user_cr['spec'].get('groups', []):
+        try:
+            group_cr = _get_cr("groups", group_name)
+            projects.update(group_cr['spec'].get('projects', []))
+        except Exception:
+            continue
+    return projects
 
 # All custom routes
 
+# Shared HTTP client pools for Keycloak and Guacamole, so that requests reuse
+# keep-alive connections instead of paying for a new TCP + TLS handshake.
+# HTTP/2 needs the h2 package installed.
+HTTP_POOL_MAX_CONNECTIONS = int(os.environ.get("HTTP_POOL_MAX_CONNECTIONS", "100"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.environ.get("HTTP_POOL_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "false").lower() == "true"
+
+http_clients = {}
+
+
+def get_http_client(name):
+    """ Get the application-lifetime HTTP client for a backend ("keycloak" or
+        "guacamole"), created on first use and closed by the lifespan hook.
+    """
+    http = http_clients.get(name)
+    if http is None or http.is_closed:
+        async def start_timer(request):
+            request.extensions["k8tre_start"] = time.perf_counter()
+
+        async def observe_latency(response):
+            request = response.request
+            UPSTREAM_LATENCY.labels(name, request.method, str(response.status_code)).observe(
+                time.perf_counter() - request.extensions["k8tre_start"]
+            )
+
+        http = httpx.AsyncClient(
+            event_hooks={"request": [start_timer], "response": [observe_latency]},
+            verify=False,
+            http2=HTTP2_ENABLED,
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+        http_clients[name] = http
+    return http
+
+
 def _hmac_sign(hex_key: str, message: bytes):
     """ Creation of HMAC headers for signed authentication
     """
@@ -208,42 +1488,501 @@ async def _get_guac_auth_token(data: dict):
     # Push based authentication logic for guacamole json auth-headers
     body = "data=" + urllib.parse.quote(standard_b64encode(ct).decode())
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    async with httpx.AsyncClient(timeout=30, verify=False) as client:
-        r = await client.post(f"{GUACAMOLE_HOST}/guacamole/api/tokens", data=body, headers=headers)
-        r.raise_for_status()
-        return r.json()["authToken"]
+    http = get_http_client("guacamole")
+    r = await http.post(f"{GUACAMOLE_HOST}/guacamole/api/tokens", data=body, headers=headers)
+    r.raise_for_status()
+    return r.json()["authToken"]
 
 def get_proj_namespace(project_name):
     """ Get the namespace for the project"""
     return f"project-{project_name}"
 
 
-def _list_vdi_instances():
-    """ List all VDI instances from all project namespaces.
+VDI_USER_LABEL = "k8tre.io/user"
+VDI_PROJECT_LABEL = "k8tre.io/project"
+
+
+def _vdi_labels(username, project):
+    """ Labels set on VDI instances so they can be selected server side
+    """
+    return {VDI_USER_LABEL: username, VDI_PROJECT_LABEL: project}
+
+
+def _get_vdi_pod_name(username, project):
+    """ Name of the pod backing a user's VDI instance
+    """
+    return f"vdi-{username}-{project}".lower()
+
+
+# Optional label selector narrowing the EndpointSlices watched server side, the
+# vdi-* services in project namespaces are always picked out client side
+VDI_ENDPOINTSLICE_SELECTOR = os.environ.get("VDI_ENDPOINTSLICE_SELECTOR", "")
+SERVICE_NAME_LABEL = "kubernetes.io/service-name"
+
+
+def _is_vdi_endpoint_slice(endpoint_slice):
+    metadata = endpoint_slice.get("metadata", {})
+    service_name = metadata.get("labels", {}).get(SERVICE_NAME_LABEL, "")
+    return service_name.startswith("vdi-") and metadata.get("namespace", "").startswith(get_proj_namespace(""))
+
+
+vdi_informers = {
+    "vdiinstances": ResourceInformer(
+        "vdiinstances", k8s_api.list_cluster_custom_object, "k8tre.io", "v1alpha1", "vdiinstances",
+        watch_timeout=CR_WATCH_TIMEOUT
+    ),
+    "endpointslices": ResourceInformer(
+        "vdi-endpointslices", k8s_discovery_api.list_endpoint_slice_for_all_namespaces,
+        label_selector=VDI_ENDPOINTSLICE_SELECTOR, include=_is_vdi_endpoint_slice,
+        watch_timeout=CR_WATCH_TIMEOUT
+    ),
+}
+
+
+class VDIIndex:
+    """ VDI instances and their pods, indexed by user and by pod IP.
+
+        Fed by the vdiinstances and VDI EndpointSlice informers, so answering "which
+        VDIs does this user have" or "is this IP a VDI pod" is a dict lookup. Pod IPs
+        come from the endpoints (ready or not) of the VDI services, so no pods are
+        watched.
     """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_user = {}
+        self._vdi_by_pod = {}
+        self._pod_ips = {}
+        self._ip_pods = {}
+        self._slice_pods = {}
+
+    @property
+    def ready(self):
+        return all(informer.synced for informer in vdi_informers.values())
+
+    def on_vdi_event(self, event_type, vdi):
+        metadata = vdi["metadata"]
+        spec = vdi.get("spec", {})
+        username, project = spec.get("user"), spec.get("project")
+        key = (metadata.get("namespace"), metadata["name"])
+        # Only trust instances that live in their own project namespace
+        if not username or not project or key[0] != get_proj_namespace(project):
+            return
+
+        pod_key = (key[0], _get_vdi_pod_name(username, project))
+        with self._lock:
+            user_vdis = self._by_user.setdefault(username, {})
+            if event_type == "DELETED":
+                user_vdis.pop(key, None)
+                if not user_vdis:
+                    self._by_user.pop(username, None)
+                self._vdi_by_pod.pop(pod_key, None)
+            else:
+                user_vdis[key] = vdi
+                self._vdi_by_pod[pod_key] = vdi
+
+    def on_endpoint_slice_event(self, event_type, endpoint_slice):
+        metadata = endpoint_slice["metadata"]
+        namespace = metadata.get("namespace")
+        slice_key = (namespace, metadata["name"])
+        pods = {}
+        if event_type != "DELETED":
+            for endpoint in endpoint_slice.get("endpoints") or []:
+                target = endpoint.get("targetRef") or {}
+                if target.get("kind") == "Pod" and endpoint.get("addresses"):
+                    pods[(namespace, target["name"])] = endpoint["addresses"][0]
+        with self._lock:
+            for key in self._slice_pods.pop(slice_key, {}):
+                old_ip = self._pod_ips.pop(key, None)
+                if old_ip and self._ip_pods.get(old_ip) == key:
+                    del self._ip_pods[old_ip]
+            for key, pod_ip in pods.items():
+                self._pod_ips[key] = pod_ip
+                self._ip_pods[pod_ip] = key
+            if pods:
+                self._slice_pods[slice_key] = pods
+
+    def for_user(self, username):
+        """ All VDI instances belonging to a user
+        """
+        return list(self._by_user.get(username, {}).values())
+
+    def all(self):
+        """ All VDI instances
+        """
+        return [vdi for user_vdis in list(self._by_user.values()) for vdi in list(user_vdis.values())]
+
+    def pod_ip(self, namespace, name):
+        """ IP of a VDI pod, None if the pod is not known (yet)
+        """
+        return self._pod_ips.get((namespace, name))
+
+    def lookup_ip(self, ip):
+        """ Get the VDI instance whose pod has this IP, None if there is none.
+        """
+        pod_key = self._ip_pods.get(ip)
+        if pod_key is None:
+            return None
+        return self._vdi_by_pod.get(pod_key)
+
+
+vdi_index = VDIIndex()
+vdi_informers["vdiinstances"].add_handler(vdi_index.on_vdi_event)
+vdi_informers["endpointslices"].add_handler(vdi_index.on_endpoint_slice_event)
+
+
+class VDIStatusBroadcaster:
+    """ Fans out changes seen by the shared vdiinstances watch to the status streams
+        of every browser waiting on that VDI.
+
+        Subscribers get a wake-up signal rather than the object itself, and re-read the
+        current status, so bursts of changes coalesce into one update.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, key):
+        """ Get a queue that is signalled whenever the VDI (namespace, name) changes
+        """
+        changes = asyncio.Queue(maxsize=1)
+        with self._lock:
+            self._subscribers.setdefault(key, set()).add((asyncio.get_running_loop(), changes))
+        return changes
+
+    def unsubscribe(self, key, changes):
+        with self._lock:
+            subscribers = self._subscribers.get(key, set())
+            subscribers.difference_update({sub for sub in subscribers if sub[1] is changes})
+            if not subscribers:
+                self._subscribers.pop(key, None)
+
+    @staticmethod
+    def _signal(changes):
+        if changes.empty():
+            changes.put_nowait(None)
+
+    def notify(self, key):
+        """ Wake up the subscribers of a VDI, safe to call from any thread
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(key, ()))
+        for loop, changes in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._signal, changes)
+            except RuntimeError:
+                # Event loop already closed
+                pass
+
+    def on_vdi_event(self, event_type, vdi):
+        metadata = vdi["metadata"]
+        self.notify((metadata.get("namespace"), metadata["name"]))
+
+
+vdi_status_broadcaster = VDIStatusBroadcaster()
+vdi_informers["vdiinstances"].add_handler(vdi_status_broadcaster.on_vdi_event)
+
+
+RDP_PORT = 3389
+RDP_PROBE_TIMEOUT = float(os.environ.get("RDP_PROBE_TIMEOUT", "2"))
+RDP_PROBE_MIN_INTERVAL = float(os.environ.get("RDP_PROBE_MIN_INTERVAL", "1"))
+RDP_PROBE_MAX_INTERVAL = float(os.environ.get("RDP_PROBE_MAX_INTERVAL", "15"))
+RDP_PROBE_IDLE_TIMEOUT = float(os.environ.get("RDP_PROBE_IDLE_TIMEOUT", "120"))
+
+
+class RDPProber:
+    """ Background prober of the RDP port of starting VDIs.
+
+        Handlers only read the latest cached result, which registers the VDI to be
+        probed. Each VDI is probed by a single task however many users or tabs are
+        waiting on it, backing off while the result is unchanged, and dropped once
+        nobody has asked about it for idle_timeout seconds.
+    """
+
+    def __init__(self, port, timeout, min_interval, max_interval, idle_timeout, on_change=None):
+        self.port = port
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.idle_timeout = idle_timeout
+        self.on_change = on_change
+        self._targets = {}
+        self._wakeup = None
+        self._loop = None
+        self._task = None
+        self._probes = set()
+
+    def is_ready(self, key, host):
+        """ Latest probe result for a VDI, False until it has been probed.
+            Must be called from the event loop.
+        """
+        now = time.monotonic()
+        target = self._targets.get(key)
+        if target is None or target["host"] != host:
+            target = self._targets[key] = {
+                "host": host,
+                "ready": False,
+                "interval": self.min_interval,
+                "next_probe": now,
+                "probing": False,
+            }
+            if self._wakeup:
+                self._wakeup.set()
+        target["last_seen"] = now
+        return target["ready"]
+
+    def forget(self, key):
+        """ Drop a VDI's probe result, so that it is not ready again until probed.
+            Can be called from any thread, e.g. by an informer handler.
+        """
+        if self._loop is None:
+            self._targets.pop(key, None)
+        else:
+            self._loop.call_soon_threadsafe(self._targets.pop, key, None)
+
+    async def _connect(self, host):
+        """ Whether the RDP port of host accepts a TCP connection
+        """
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, self.port), timeout=self.timeout
+            )
+            writer.close()
+            return True
+        except (OSError, asyncio.TimeoutError):
+            return False
+
+    async def _probe(self, key, target):
+        try:
+            ready = await self._connect(target["host"])
+        finally:
+            target["probing"] = False
+
+        if ready != target["ready"]:
+            logger.info("RDP port of %s is %s", target["host"], "open" if ready else "closed")
+            target["ready"] = ready
+            target["interval"] = self.min_interval
+            if self.on_change and self._targets.get(key) is target:
+                self.on_change(key)
+        else:
+            target["interval"] = min(target["interval"] * 2, self.max_interval)
+        target["next_probe"] = time.monotonic() + target["interval"]
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            next_probe = now + self.max_interval
+            for key, target in list(self._targets.items()):
+                if now - target["last_seen"] > self.idle_timeout:
+                    del self._targets[key]
+                elif not target["probing"]:
+                    if target["next_probe"] <= now:
+                        target["probing"] = True
+                        probe = asyncio.create_task(self._probe(key, target))
+                        self._probes.add(probe)
+                        probe.add_done_callback(self._probes.discard)
+                    else:
+                        next_probe = min(next_probe, target["next_probe"])
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_probe - now)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for probe in list(self._probes):
+            probe.cancel()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class ServiceReadiness:
+    """ Whether each VDI service has a ready endpoint, from the EndpointSlice informer.
+
+        A service can be backed by several slices, it is ready if any of them has an
+        endpoint whose ready condition is not false (unset means ready).
+    """
+
+    def __init__(self, on_change=None):
+        self._lock = threading.Lock()
+        self._slices = {}
+        self.on_change = on_change
+
+    @property
+    def ready(self):
+        return vdi_informers["endpointslices"].synced
+
+    @staticmethod
+    def _has_ready_endpoint(endpoint_slice):
+        return any(
+            (endpoint.get("conditions") or {}).get("ready") is not False
+            for endpoint in endpoint_slice.get("endpoints") or []
+        )
+
+    def on_endpoint_slice_event(self, event_type, endpoint_slice):
+        metadata = endpoint_slice["metadata"]
+        service = (metadata.get("namespace"), metadata.get("labels", {}).get(SERVICE_NAME_LABEL))
+        with self._lock:
+            before = self._is_ready(service)
+            slices = self._slices.setdefault(service, {})
+            if event_type == "DELETED":
+                slices.pop(metadata["name"], None)
+            else:
+                slices[metadata["name"]] = self._has_ready_endpoint(endpoint_slice)
+            if not slices:
+                del self._slices[service]
+            changed = before != self._is_ready(service)
+        if changed and self.on_change:
+            namespace, service_name = service
+            # Service vdi-{username}-{project} backs VDI instance {username}-{project}
+            self.on_change((namespace, service_name[len("vdi-"):].lower()))
+
+    def _is_ready(self, service):
+        return any(self._slices.get(service, {}).values())
+
+    def is_ready(self, namespace, service_name):
+        with self._lock:
+            return self._is_ready((namespace, service_name))
+
+
+service_readiness = ServiceReadiness(on_change=vdi_status_broadcaster.notify)
+vdi_informers["endpointslices"].add_handler(service_readiness.on_endpoint_slice_event)
+
+
+rdp_prober = RDPProber(
+    RDP_PORT, RDP_PROBE_TIMEOUT, RDP_PROBE_MIN_INTERVAL, RDP_PROBE_MAX_INTERVAL,
+    RDP_PROBE_IDLE_TIMEOUT, on_change=vdi_status_broadcaster.notify
+)
+
+
+def _on_vdi_rdp_event(event_type, vdi):
+    """ Forget the probe result of a deleted VDI, a relaunch within the idle timeout
+        must not be reported ready before its own RDP port is open
+    """
+    if event_type == "DELETED":
+        metadata = vdi["metadata"]
+        rdp_prober.forget((metadata.get("namespace"), metadata["name"]))
+
+
+vdi_informers["vdiinstances"].add_handler(_on_vdi_rdp_event)
+
+
+def _list_vdi_instances(username=None, project=None):
+    """ List VDI instances from all project namespaces, from the VDI index once it is
+        synced, otherwise with a single cluster-scoped call where the user/project
+        filters are applied server side using label selectors.
+    """
+    if vdi_index.ready:
+        vdis = vdi_index.for_user(username) if username else vdi_index.all()
+        return [vdi for vdi in vdis if not project or vdi["spec"].get("project") == project]
+
+    selector = []
+    if username:
+        selector.append(f"{VDI_USER_LABEL}={username}")
+    if project:
+        selector.append(f"{VDI_PROJECT_LABEL}={project}")
+
+    try:
+        crd = k8s_api.list_cluster_custom_object(
+            group="k8tre.io", version="v1alpha1", plural="vdiinstances",
+            label_selector=",".join(selector)
+        )
+    except Exception as e:
+        logger.error("Error listing VDI instances across namespaces: %s", e)
+        return []
+
     all_items = []
+    for vdi in crd.get("items", []):
+        spec = vdi.get("spec", {})
+        # Only trust instances that live in their own project namespace
+        if vdi.get("metadata", {}).get("namespace") != get_proj_namespace(spec.get("project")):
+            continue
+        if username and spec.get("user") != username:
+            continue
+        if project and spec.get("project") != project:
+            continue
+        all_items.append(vdi)
+    return all_items
+
+
+def _label_vdi_instance(vdi_name, username, project):
+    """ Add the user/project labels to an existing VDI instance
+    """
+    k8s_api.patch_namespaced_custom_object(
+        group="k8tre.io",
+        version="v1alpha1",
+        namespace=get_proj_namespace(project),
+        plural="vdiinstances",
+        name=vdi_name,
+        body={"metadata": {"labels": _vdi_labels(username, project)}}
+    )
+
+
+def _label_legacy_vdi_instances():
+    """ Backfill labels on VDI instances created before they were labelled,
+        otherwise label-selected listings would not find them.
+    """
     try:
-        projects = k8s_api.list_namespaced_custom_object(
-            "research.k8tre.io", "v1alpha1", NAMESPACE, "projects"
+        crd = k8s_api.list_cluster_custom_object(
+            group="k8tre.io", version="v1alpha1", plural="vdiinstances",
+            label_selector=f"!{VDI_USER_LABEL}"
         )
-        for proj in projects.get("items", []):
-            proj_name = proj["metadata"]["name"]
-            ns = get_proj_namespace(proj_name)
+        for vdi in crd.get("items", []):
+            spec = vdi.get("spec", {})
             try:
-                crd = k8s_api.list_namespaced_custom_object(
-                    group="k8tre.io", version="v1alpha1",
-                    namespace=ns, plural="vdiinstances"
-                )
-                all_items.extend(crd.get("items", []))
+                _label_vdi_instance(vdi["metadata"]["name"], spec["user"], spec["project"])
+                logger.info("Labelled VDI instance %s", vdi["metadata"]["name"])
             except Exception as e:
-                print(
-                    f"Error listing VDI instances in namespace '{ns}' for project '{proj_name}': {e}",
-                    flush=True,
-                )
-                continue
+                logger.warning("Error labelling VDI instance %s: %s", vdi["metadata"].get("name"), e)
     except Exception as e:
-        print(f"Error listing VDI instances across namespaces: {e}", flush=True)
-    return all_items
+        logger.warning("Error listing unlabelled VDI instances: %s", e)
+
+
+def _vdi_connection(vdi):
+    """ Guacamole RDP connection for a VDI instance, None if it cannot be
+        connected to yet
+    """
+    spec = vdi.get("spec", {})
+    status = vdi.get("status", {})
+    v_user = spec.get("user")
+    v_proj = spec.get("project")
+    pwd = status.get("password")
+    if not pwd or status.get("phase", "Unknown") not in ("Ready", "Running"):
+        return None
+
+    hostname = f"vdi-{v_user}-{v_proj}.{get_proj_namespace(v_proj)}.svc.cluster.local"
+    return {
+        "protocol": "rdp",
+        "parameters": {
+            "hostname": hostname,
+            "port": "3389",
+            # Get unique linux username
+            "username": status.get("linuxUser", "ubuntu"),
+            "password": pwd,
+            "ignore-cert": "true",
+            "security": "any",
+            "resize-method": "reconnect",
+            "enable-drive": "false",
+            "create-drive-path": "false",
+            "console": "true",
+            "disable-auth": "true",
+            "color-depth": "32",
+            "disable-copy": "true",
+            "disable-paste": "true",
+        },
+    }
 
 
 def _build_connections_for_user(username):
@@ -251,45 +1990,149 @@ def _build_connections_for_user(username):
         We filter those existing CRDs based on user name
     """
     conns = {}
-    vdi_items = _list_vdi_instances()
+    vdi_items = _list_vdi_instances(username=username)
 
     for vdi in vdi_items:
         spec = vdi.get("spec", {})
         status = vdi.get("status", {})
         v_user = spec.get("user")
         v_proj = spec.get("project")
-        pwd = status.get("password")
-        phase = status.get("phase", "Unknown")
-        # Get unique linux username
-        linux_user = status.get("linuxUser", "ubuntu")
         vdi_name = vdi.get("metadata", {}).get("name", "unknown")
-        print(f"Checking VDI {vdi_name}: user={v_user}, project={v_proj}, linux_user={linux_user}, phase={phase}, has_password={bool(pwd)}", flush=True)
-        if v_user == username and pwd and phase in ("Ready", "Running"):
+        logger.debug("Checking VDI %s: user=%s, project=%s, phase=%s, has_password=%s", vdi_name, v_user, v_proj, status.get("phase", "Unknown"), bool(status.get("password")))
+        connection = _vdi_connection(vdi)
+        if v_user == username and connection:
             conn_id = f"{v_proj}-desktop"
-            print(f"Adding connection: {conn_id} for VDI {vdi_name} with Linux user: {linux_user}", flush=True)
-            hostname = f"vdi-{v_user}-{v_proj}.{get_proj_namespace(v_proj)}.svc.cluster.local"
-            conns[conn_id] = {
-                "protocol": "rdp",
-                "parameters": {
-                    "hostname": hostname,
-                    "port": "3389",
-                    "username": linux_user,
-                    "password": pwd,
-                    "ignore-cert": "true",
-                    "security": "any",
-                    "resize-method": "reconnect",
-                    "enable-drive": "false",
-                    "create-drive-path": "false",
-                    "console": "true",
-                    "disable-auth": "true",
-                    "color-depth": "32",
-                    "disable-copy": "true",
-                    "disable-paste": "true",
-                },
-            }
+            logger.debug("Adding connection: %s for VDI %s with Linux user: %s", conn_id, vdi_name, connection["parameters"]["username"])
+            conns[conn_id] = connection
     return conns
 
 
+async def _get_project_connections(username, project):
+    """ Guacamole connections of a user's VDIs in a project
+    """
+    with _timed("connections"):
+        if vdi_index.ready:
+            all_connections = _build_connections_for_user(username)
+        else:
+            all_connections = await _run_k8s(_build_connections_for_user, username)
+
+    return {
+        conn_id: conn_data
+        for conn_id, conn_data in all_connections.items()
+        if conn_id.startswith(f"{project}-")
+    }
+
+
+# A Guacamole auth token is minted when the status stream sees a VDI become ready and
+# kept for the next connect until shortly before it expires. Each is used once,
+# Guacamole invalidates it when the user logs out or disconnects. A VDI is pre-minted
+# for at most once per token lifetime, so status pages left open do not pile up
+# unused Guacamole sessions. Keep the TTL below Guacamole's api-session-timeout.
+GUACAMOLE_TOKEN_TTL = int(os.environ.get("GUACAMOLE_TOKEN_TTL", "900"))
+GUACAMOLE_TOKEN_EXPIRY_MARGIN = int(os.environ.get("GUACAMOLE_TOKEN_EXPIRY_MARGIN", "60"))
+guac_tokens = TTLCache(1024, GUACAMOLE_TOKEN_TTL - GUACAMOLE_TOKEN_EXPIRY_MARGIN, name="guacamole_tokens")
+guac_token_premints = TTLCache(1024, GUACAMOLE_TOKEN_TTL - GUACAMOLE_TOKEN_EXPIRY_MARGIN)
+guac_token_mints = {}
+
+
+def _guac_connections_fingerprint(connections):
+    """ Hash of a connection map, a change of VDI password or host changes it
+    """
+    return hashlib.sha256(json.dumps(connections, sort_keys=True).encode()).hexdigest()
+
+
+async def _mint_guac_token(username, project, connections, fingerprint, keep):
+    data = {
+        "username": username,
+        "expires": int(time.time() * 1000) + 60_000,
+        "connections": connections,
+    }
+    logger.info("Minting Guacamole token: username=%s, connections=%s", username, list(connections.keys()), extra={"event": "guacamole.mint"})
+    with tracer.start_as_current_span("guacamole.mint_token") as span, _timed("guac_mint"):
+        span.set_attribute("k8tre.project", project)
+        auth_token = await _get_guac_auth_token(data)
+    if keep:
+        guac_tokens.set((username, project), {"token": auth_token, "fingerprint": fingerprint})
+    return auth_token
+
+
+def _guac_token_mint(username, project, connections, keep=False):
+    """ Mint of a Guacamole token for these connections, shared by concurrent requests.
+        With keep the token is cached for the next connect.
+    """
+    fingerprint = _guac_connections_fingerprint(connections)
+    key = (username, project, fingerprint)
+    mint = guac_token_mints.get(key)
+    if mint is None:
+        mint = asyncio.ensure_future(_mint_guac_token(username, project, connections, fingerprint, keep))
+        guac_token_mints[key] = mint
+        mint.add_done_callback(lambda _: guac_token_mints.pop(key, None))
+    return mint
+
+
+async def _get_guac_token(username, project, connections):
+    """ Guacamole auth token to connect with, the pre-minted one if it is for these
+        connections or else a new one. Either way no later connect gets the same token.
+    """
+    fingerprint = _guac_connections_fingerprint(connections)
+    cached = guac_tokens.pop((username, project))
+    if cached and cached["fingerprint"] == fingerprint:
+        return cached["token"]
+
+    auth_token = await asyncio.shield(_guac_token_mint(username, project, connections))
+    # The mint may have been a pre-mint, which kept the token
+    cached = guac_tokens.get((username, project))
+    if cached and cached["token"] == auth_token:
+        guac_tokens.pop((username, project))
+    return auth_token
+
+
+async def _premint_guac_token(username, project):
+    try:
+        connections = await _get_project_connections(username, project)
+        if connections:
+            await asyncio.shield(_guac_token_mint(username, project, connections, keep=True))
+    except Exception as e:
+        logger.warning("Error pre-minting Guacamole token for %s/%s: %s", username, project, e)
+
+
+def _schedule_guac_token(username, project):
+    """ Mint a Guacamole token in the background so connect can redirect at once,
+        unless this VDI already had one pre-minted within the token lifetime
+    """
+    key = (username, project)
+    if guac_token_premints.get(key) is not None or guac_tokens.get(key) is not None:
+        return
+    guac_token_premints.set(key, asyncio.create_task(_premint_guac_token(username, project)))
+
+
+def _forget_guac_tokens(username):
+    for cache in (guac_tokens, guac_token_premints):
+        for key in cache.keys():
+            if key[0] == username:
+                cache.pop(key)
+
+
+def _on_vdi_guac_event(event_type, vdi):
+    """ Drop a cached Guacamole token when its VDI goes away or its password or
+        host changes
+    """
+    spec = vdi.get("spec", {})
+    key = (spec.get("user"), spec.get("project"))
+    if event_type == "DELETED":
+        # A recreated VDI is pre-minted afresh
+        guac_token_premints.pop(key)
+    cached = guac_tokens.get(key)
+    if cached is None:
+        return
+    connection = _vdi_connection(vdi) if event_type != "DELETED" else None
+    if connection is None or _guac_connections_fingerprint({f"{key[1]}-desktop": connection}) != cached["fingerprint"]:
+        guac_tokens.pop(key)
+
+
+vdi_informers["vdiinstances"].add_handler(_on_vdi_guac_event)
+
+
 def _sign(user, project, audience):
     """ Create a unique signature for the header authentication.
     """
@@ -302,31 +2145,27 @@ def _is_user_authorised_project(username, project):
     """ Check if user has access to a project via their groups
     """
     try:
-        user_cr = k8s_api.get_namespaced_custom_object(
-            "identity.k8tre.io", "v1alpha1", NAMESPACE, "users", username
-        )
-        user_groups = user_cr['spec'].get('groups', [])
-
-        # Check if user has access to this project
-        for group_name in user_groups:
-            try:
-                group_cr = k8s_api.get_namespaced_custom_object(
-                    "identity.k8tre.io", "v1alpha1", NAMESPACE, "groups", group_name
-                )
-                group_projects = group_cr['spec'].get('projects', [])
-                if project in group_projects:
-                    print(f"User {username} authorised for project {project} via group {group_name}", flush=True)
-                    return True
-            except Exception:
-                continue
+        if project in _get_user_projects(username):
+            logger.debug("User %s authorised for project %s", username, project, extra={"event": "authz.granted"})
+            return True
 
-        print(f"User {username} not authorised for project {project}", flush=True)
+        logger.info("User %s not authorised for project %s", username, project, extra={"event": "authz.denied"})
         return False
 
     except Exception as e:
-        print(f"Authorisation failed for user {username}: {e}", flush=True)
+        logger.warning("Authorisation failed for user %s: %s", username, e)
         return False
 
+async def _authorise_project(username, project):
+    """ Async _is_user_authorised_project. It only leaves the event loop when the
+        entitlement index is not ready and the CRs have to be read.
+    """
+    with _timed("authz"):
+        if entitlements.ready:
+            return _is_user_authorised_project(username, project)
+        return await _run_k8s(_is_user_authorised_project, username, project)
+
+
 def _is_user_vdi(username, project):
     """ Check if user has a VDI instance running for the project
     """
@@ -343,14 +2182,14 @@ def _is_user_vdi(username, project):
         status = vdi_cr.get("status", {})
         phase = status.get("phase", "Unknown")
         if phase in ("Running", "Ready"):
-            print(f"VDI context detected: {username}/{project} (phase: {phase})", flush=True)
+            logger.debug("VDI context detected: %s/%s (phase: %s)", username, project, phase)
             return True
         else:
-            print(f"VDI exists but not running: {username}/{project} (phase: {phase})", flush=True)
+            logger.debug("VDI exists but not running: %s/%s (phase: %s)", username, project, phase)
             return False
 
     except Exception as e:
-        print(f"No running VDI found for {username}/{project}: {e}", flush=True)
+        logger.debug("No running VDI found for %s/%s: %s", username, project, e)
         return False
 
 def _get_client_ip(request: Request):
@@ -372,14 +2211,44 @@ def _get_client_ip(request: Request):
 
     return "unknown"
 
+def _unindexed_vdis(username):
+    """ Running VDIs of the user whose pod IP the VDI index does not know, e.g. while
+        the pod is not yet in its service's EndpointSlice. Their pods have to be read.
+    """
+    unindexed = []
+    for vdi in vdi_index.for_user(username):
+        project = vdi.get("spec", {}).get("project")
+        phase = vdi.get("status", {}).get("phase", "Unknown")
+        pod_name = _get_vdi_pod_name(username, project)
+        if phase in ("Running", "Ready") and vdi_index.pod_ip(get_proj_namespace(project), pod_name) is None:
+            unindexed.append(vdi)
+    return unindexed
+
+
 def _is_request_vdi_pod(request: Request, username: str):
     """ Detect if the request is coming from a VDI pod.
     """
     client_ip = _get_client_ip(request)
+    if vdi_index.ready:
+        vdi = vdi_index.lookup_ip(client_ip)
+        if vdi is not None:
+            spec = vdi.get("spec", {})
+            phase = vdi.get("status", {}).get("phase", "Unknown")
+            if spec.get("user") == username and phase in ("Running", "Ready"):
+                logger.info("Request from inside VDI pod: %s (IP: %s)", vdi["metadata"]["name"], client_ip)
+                return True, spec.get("project")
+            return False, None
+        # Never take a VDI request for host access because its pod is not indexed
+        all_vdis = _unindexed_vdis(username)
+        if not all_vdis:
+            return False, None
+    else:
+        all_vdis = None
+
     try:
         # Get all VDI instances for this user
-        all_vdis = _list_vdi_instances()
-        v1 = client.CoreV1Api()
+        if all_vdis is None:
+            all_vdis = _list_vdi_instances(username=username)
         for vdi in all_vdis:
             spec = vdi.get("spec", {})
             status = vdi.get("status", {})
@@ -393,24 +2262,34 @@ def _is_request_vdi_pod(request: Request, username: str):
 
             # Get the pod IP for this VDI
             try:
-                pod_name = f"vdi-{username}-{vdi_project}".lower()
-                pod = v1.read_namespaced_pod(name=pod_name, namespace=get_proj_namespace(vdi_project))
+                pod_name = _get_vdi_pod_name(username, vdi_project)
+                pod = k8s_core_api.read_namespaced_pod(name=pod_name, namespace=get_proj_namespace(vdi_project))
                 pod_ip = pod.status.pod_ip
                 if pod_ip and client_ip == pod_ip:
-                    print(f"Request from inside VDI pod: {pod_name} (IP: {pod_ip})", flush=True)
+                    logger.info("Request from inside VDI pod: %s (IP: %s)", pod_name, pod_ip)
                     return True, vdi_project
 
             except Exception as e:
-                print(f"Error checking pod IP for {pod_name}: {e}", flush=True)
+                logger.warning("Error checking pod IP for %s: %s", pod_name, e)
                 continue
 
         return False, None
 
     except Exception as e:
-        print(f"Error detecting VDI context from IP: {e}", flush=True)
+        logger.warning("Error detecting VDI context from IP: %s", e)
         return False, None
 
 
+async def _detect_vdi_pod(request: Request, username: str):
+    """ Async _is_request_vdi_pod. It only leaves the event loop when the VDI index
+        is not ready or a running VDI's pod is not indexed, and pods have to be read.
+    """
+    with _timed("vdi_detect"):
+        if vdi_index.ready and not _unindexed_vdis(username):
+            return _is_request_vdi_pod(request, username)
+        return await _run_k8s(_is_request_vdi_pod, request, username)
+
+
 def get_project_tokens(request: Request):
     """ Get project-scoped tokens from session.
     """
@@ -435,7 +2314,7 @@ def set_project_token(request: Request, project, token, refresh_token=None):
             request.session["project_refresh_tokens"] = {}
         request.session["project_refresh_tokens"][project] = refresh_token
 
-    print(f"Stored tokens for project: {project}", flush=True)
+    logger.debug("Stored tokens for project: %s", project)
 
 
 def get_token_for_project(request: Request, project):
@@ -445,54 +2324,212 @@ def get_token_for_project(request: Request, project):
     return project_tokens.get(project)
 
 
-def clear_project_token(request: Request, project):
-    """ Remove tokens for a specific project.
-    """
-    project_tokens = request.session.get("project_tokens", {})
-    project_refresh_tokens = request.session.get("project_refresh_tokens", {})
+def clear_project_token(request: Request, project):
+    """ Remove tokens for a specific project.
+    """
+    project_tokens = request.session.get("project_tokens", {})
+    project_refresh_tokens = request.session.get("project_refresh_tokens", {})
+
+    if project in project_tokens:
+        del project_tokens[project]
+    if project in project_refresh_tokens:
+        del project_refresh_tokens[project]
+
+    logger.debug("Cleared tokens for project: %s", project)
+
+
+TOKEN_REFRESH_SCHEDULER_ENABLED = os.environ.get("K8TRE_TOKEN_REFRESH_SCHEDULER", "false").lower() == "true"
+# Tokens of sessions seen in the last TOKEN_REFRESH_IDLE_TIMEOUT seconds are refreshed
+# TOKEN_REFRESH_AHEAD seconds before they expire, before check_token_expiry's 5 minute margin
+TOKEN_REFRESH_AHEAD = int(os.environ.get("TOKEN_REFRESH_AHEAD", "420"))
+TOKEN_REFRESH_INTERVAL = float(os.environ.get("TOKEN_REFRESH_INTERVAL", "30"))
+TOKEN_REFRESH_IDLE_TIMEOUT = int(os.environ.get("TOKEN_REFRESH_IDLE_TIMEOUT", "1800"))
+
+
+def _token_expiry(token):
+    """ exp claim of a token, 0 if it cannot be read
+    """
+    try:
+        return jwt.decode(token, options={"verify_signature": False}).get("exp", 0)
+    except Exception:
+        return 0
+
+
+class TokenRefresher:
+    """ Refreshes Keycloak tokens with at most one refresh in flight per user and project.
+
+        Concurrent callers with the same refresh token await the same refresh. Its
+        result is kept, until the new access token expires, under the refresh token it
+        replaced, so requests whose session still holds exactly that refresh token reuse
+        it instead of refreshing again (and racing each other for the rotated refresh
+        token). Older refresh tokens are never answered from the cache, Keycloak decides. When started, it also
+        refreshes the tokens of recently active sessions shortly before they expire,
+        so requests rarely wait on Keycloak.
+    """
+
+    def __init__(self, refresh_ahead, interval, idle_timeout):
+        self.refresh_ahead = refresh_ahead
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self._inflight = {}
+        self._results = TTLCache(4096, 3600, name="token_refreshes")
+        self._sessions = {}
+        self._task = None
+
+    @staticmethod
+    def _hash(refresh_token):
+        return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+    def _reusable(self, refresh_token):
+        """ Tokens refreshed from exactly this refresh token, None if there are none
+            that are still fresh.
+        """
+        cached = self._results.get(self._hash(refresh_token))
+        if cached and _token_expiry(cached["tokens"]["access_token"]) - time.time() >= 300:
+            return cached["tokens"]
+        return None
+
+    async def _refresh(self, username, project, refresh_token):
+        http = get_http_client("keycloak")
+        with tracer.start_as_current_span("keycloak.refresh_token") as span, _timed("token_refresh"):
+            span.set_attribute("k8tre.project", project or "")
+            response = await http.post(
+                f"{internal_base}/protocol/openid-connect/token",
+                data={
+                    "grant_type": "refresh_token",
+                    "refresh_token": refresh_token,
+                    "client_id": os.environ["KEYCLOAK_CLIENT_ID"],
+                    "client_secret": os.environ["KEYCLOAK_CLIENT_SECRET"],
+                },
+                headers={"Content-Type": "application/x-www-form-urlencoded"}
+            )
+            span.set_attribute("http.response.status_code", response.status_code)
+
+        if response.status_code != 200:
+            TOKEN_REFRESHES.labels("failed").inc()
+            logger.warning("Token refresh failed: %s - %s", response.status_code, response.text)
+            return None
+
+        token_data = response.json()
+        token_data.setdefault("refresh_token", refresh_token)
+        TOKEN_REFRESHES.labels("refreshed").inc()
+        self._results.set(
+            self._hash(refresh_token), {"username": username, "tokens": token_data},
+            expires_at=_token_expiry(token_data["access_token"])
+        )
+        return token_data
+
+    async def refresh(self, refresh_token, username=None, project=None):
+        """ Keycloak token response for refresh_token, None if it could not be refreshed.
+
+            Only callers holding the same refresh token share a call, separate
+            sessions of a user have separate Keycloak sessions and tokens.
+        """
+        tokens = self._reusable(refresh_token)
+        if tokens is not None:
+            TOKEN_REFRESHES.labels("reused").inc()
+            return tokens
+
+        key = (username, project, self._hash(refresh_token)) if username else self._hash(refresh_token)
+        refresh = self._inflight.get(key)
+        if refresh is None:
+            refresh = asyncio.ensure_future(self._refresh(username, project, refresh_token))
+            self._inflight[key] = refresh
+            refresh.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            TOKEN_REFRESHES.labels("coalesced").inc()
+        return await asyncio.shield(refresh)
+
+    def track(self, username, project, access_token, refresh_token):
+        """ Note a session's current tokens, for the scheduler to refresh ahead of expiry
+        """
+        if self._task is None or not refresh_token:
+            return
+        self._sessions[(username, project)] = {
+            "refresh_token": refresh_token,
+            "expires_at": _token_expiry(access_token),
+            "last_seen": time.monotonic(),
+        }
+
+    def forget(self, username):
+        """ Drop a user's tracked sessions and kept refresh results, e.g. on logout
+        """
+        for key in [key for key in self._sessions if key[0] == username]:
+            self._sessions.pop(key, None)
+        for key in self._results.keys():
+            cached = self._results.get(key)
+            if cached and cached["username"] == username:
+                self._results.pop(key)
+
+    async def _refresh_due(self):
+        now = time.monotonic()
+        for key, session in list(self._sessions.items()):
+            if now - session["last_seen"] > self.idle_timeout:
+                self._sessions.pop(key, None)
+            elif session["expires_at"] - time.time() < self.refresh_ahead:
+                username, project = key
+                try:
+                    tokens = await self.refresh(session["refresh_token"], username, project)
+                except Exception as e:
+                    logger.warning("Scheduled token refresh for %s failed: %s", username, e)
+                    tokens = None
+                if tokens is None:
+                    # Most likely the session has ended, requests will log in again
+                    self._sessions.pop(key, None)
+                elif self._sessions.get(key) is session:
+                    session["refresh_token"] = tokens["refresh_token"]
+                    session["expires_at"] = _token_expiry(tokens["access_token"])
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._refresh_due()
+            except Exception as e:
+                logger.warning("Token refresh scheduler failed: %s", e)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
 
-    if project in project_tokens:
-        del project_tokens[project]
-    if project in project_refresh_tokens:
-        del project_refresh_tokens[project]
 
-    print(f"Cleared tokens for project: {project}", flush=True)
+token_refresher = TokenRefresher(TOKEN_REFRESH_AHEAD, TOKEN_REFRESH_INTERVAL, TOKEN_REFRESH_IDLE_TIMEOUT)
 
 
-async def refresh_access_token(request: Request, project=None):
-    """ Refresh access token using refresh token.
+def _session_refresh_token(request: Request, project=None):
+    """ Refresh token of the project in the session, or the global one
     """
     if project:
-        project_refresh_tokens = get_project_refresh_tokens(request)
-        refresh_token = project_refresh_tokens.get(project)
-        if not refresh_token:
-            print(f"No refresh token for project {project}, falling back to global", flush=True)
-            refresh_token = request.session.get("refresh_token")
-    else:
-        refresh_token = request.session.get("refresh_token")
+        refresh_token = get_project_refresh_tokens(request).get(project)
+        if refresh_token:
+            return refresh_token
+        logger.debug("No refresh token for project %s, falling back to global", project)
+    return request.session.get("refresh_token")
 
+
+async def refresh_access_token(request: Request, project=None):
+    """ Refresh access token using refresh token.
+    """
+    refresh_token = _session_refresh_token(request, project)
     if not refresh_token:
-        print("No refresh token available", flush=True)
+        logger.info("No refresh token available")
         return None
 
     try:
-        print(f"Attempting to refresh access token{' for project ' + project if project else ''}...", flush=True)
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.post(
-                f"{internal_base}/protocol/openid-connect/token",
-                data={
-                    "grant_type": "refresh_token",
-                    "refresh_token": refresh_token,
-                    "client_id": os.environ["KEYCLOAK_CLIENT_ID"],
-                    "client_secret": os.environ["KEYCLOAK_CLIENT_SECRET"],
-                },
-                headers={"Content-Type": "application/x-www-form-urlencoded"}
-            )
-
-        if response.status_code == 200:
-            token_data = response.json()
+        logger.debug("Attempting to refresh access token for project %s", project or "(global)")
+        username = (request.session.get("user") or {}).get("preferred_username")
+        token_data = await token_refresher.refresh(refresh_token, username, project)
+        if token_data:
             new_access_token = token_data["access_token"]
-            new_refresh_token = token_data.get("refresh_token", refresh_token)
+            new_refresh_token = token_data["refresh_token"]
 
             # Store tokens per project
             if project:
@@ -506,13 +2543,13 @@ async def refresh_access_token(request: Request, project=None):
             if "id_token" in token_data:
                 request.session["id_token"] = token_data["id_token"]
 
-            print(f"Token refreshed successfully{' for project ' + project if project else ''}", flush=True)
+            if username:
+                token_refresher.track(username, project, new_access_token, new_refresh_token)
+            logger.info("Token refreshed for project %s", project or "(global)", extra={"event": "token.refreshed"})
             return new_access_token
-        else:
-            print(f"Token refresh failed: {response.status_code} - {response.text}", flush=True)
 
     except Exception as e:
-        print(f"Token refresh error: {e}", flush=True)
+        logger.warning("Token refresh error: %s", e)
 
     return None
 
@@ -534,7 +2571,7 @@ def check_token_expiry(token):
         
         return expires_soon, time_left
     except Exception as e:
-        print(f"Token expiry check failed: {e}", flush=True)
+        logger.warning("Token expiry check failed: %s", e)
         return True, 0
 
 async def ensure_valid_token(request: Request, project=None):
@@ -544,27 +2581,30 @@ async def ensure_valid_token(request: Request, project=None):
     if project:
         token = get_token_for_project(request, project)
         if not token:
-            print(f"No token for project {project}, trying global token", flush=True)
+            logger.debug("No token for project %s, trying global token", project)
             token = request.session.get("token")
     else:
         token = request.session.get("token")
 
     if not token:
-        print(f"No token in session{' for project ' + project if project else ''}", flush=True)
+        logger.info("No token in session for project %s", project or "(global)")
         return None
 
     expires_soon, time_left = check_token_expiry(token)
 
     if expires_soon:
-        print(f"Token expires in {time_left} seconds, refreshing...", flush=True)
+        logger.debug("Token expires in %s seconds, refreshing", time_left)
         new_token = await refresh_access_token(request, project=project)
         if new_token:
             return new_token
         else:
-            print("Token refresh failed, user needs to re-login", flush=True)
+            logger.info("Token refresh failed, user needs to re-login")
             return None
     else:
-        print(f"Token is valid for {time_left} more seconds", flush=True)
+        logger.debug("Token is valid for %s more seconds", time_left, extra={"event": "token.valid"})
+        user = request.session.get("user")
+        if user:
+            token_refresher.track(user.get("preferred_username"), project, token, _session_refresh_token(request, project))
         return token
 
 def verify_token(auth_header):
@@ -575,17 +2615,12 @@ def verify_token(auth_header):
 
     token = auth_header.split(" ", 1)[1]
 
-    import ssl
-    ssl_context = ssl.create_default_context()
-    ssl_context.check_hostname = False
-    ssl_context.verify_mode = ssl.CERT_NONE
-
-    jwks_client = PyJWKClient(jwks_url, ssl_context=ssl_context)
-    signing_key = jwks_client.get_signing_key_from_jwt(token)
-
     expected_issuer = f"{build_service_url('keycloak')}/realms/{keycloak_realm}"
 
     try:
+        # Signing keys come from the process-wide cache, no JWKS fetch per request
+        kid = jwt.get_unverified_header(token).get("kid")
+        signing_key = jwks_cache.get_signing_key(kid)
         decoded = jwt.decode(
             token,
             signing_key.key,
@@ -595,8 +2630,8 @@ def verify_token(auth_header):
         )
         return decoded
     except Exception as e:
-        print(f"Token verification failed: {e}", flush=True)
-        raise HTTPException(status_code=401, detail="Invalid token")
+        logger.info("Token verification failed: %s", e, extra={"event": "token.invalid"})
+        raise HTTPException(status_code=401, detail="Invalid token") from e
 
 @app.get("/", response_class=HTMLResponse)
 async def homepage(request: Request):
@@ -623,7 +2658,7 @@ async def login(request: Request):
     """
     request.session.clear()
     redirect_uri = build_service_url("portal", "/auth/callback")
-    print(f"Login redirect URI: {redirect_uri}", flush=True)
+    logger.debug("Login redirect URI: %s", redirect_uri)
 
     return await oauth.keycloak.authorize_redirect(request, redirect_uri)
 
@@ -633,50 +2668,47 @@ async def auth_callback(request: Request):
     """
     try:
         if "_state" in request.session:
-            print(f"Found existing state: {request.session.get('_state')}", flush=True)
+            logger.debug("Found existing OAuth state in session")
 
         token = await oauth.keycloak.authorize_access_token(request)
         access_token = token.get('access_token') if hasattr(token, 'get') else token['access_token']
         refresh_token = token.get('refresh_token')
         userinfo_url = f"{keycloak_internal_url}/realms/{keycloak_realm}/protocol/openid-connect/userinfo"
 
-        async with httpx.AsyncClient(timeout=30.0, verify=False) as client:
-            response = await client.get(
-                userinfo_url,
-                headers={"Authorization": f"Bearer {access_token}"}
-            )
+        http = get_http_client("keycloak")
+        response = await http.get(
+            userinfo_url,
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
             
         if response.status_code == 200:
             user = response.json()
             username = user.get('preferred_username', 'unknown')
-            print(f"User authenticated: {username}", flush=True)
+            logger.info("User authenticated: %s", username)
 
             request.session["user"] = dict(user)
             request.session["token"] = access_token
             request.session["refresh_token"] = refresh_token
             request.session["session_created"] = int(time.time())
+            token_refresher.track(username, None, access_token, refresh_token)
 
             # Check if request coming from VDI pod
-            is_from_vdi, vdi_project = _is_request_vdi_pod(request, username)
+            is_from_vdi, vdi_project = await _detect_vdi_pod(request, username)
 
             if is_from_vdi and vdi_project:
                 # restrict to that project only
                 request.session["vdi_context"] = True
                 request.session["vdi_project"] = vdi_project
-                print(f"User {username} logged in using VDI (project: {vdi_project})", flush=True)
+                logger.info("User %s logged in using VDI (project: %s)", username, vdi_project)
             else:
                 # full portal access
                 request.session["vdi_context"] = False
                 request.session.pop("vdi_project", None)
-                print(f"User {username} logged in using host", flush=True)
+                logger.info("User %s logged in using host", username)
 
             # Store session info for cleanup
-            active_user_sessions[username] = {
-                "token": access_token,
-                "refresh_token": refresh_token,
-                "session_id": request.session.get("_session_id", "unknown")
-            }
-            print(f"Session after storing user: {dict(request.session)}", flush=True)
+            active_user_sessions.add(username, access_token, refresh_token, request.session.get("_session_id", "unknown"))
+            logger.debug("Session keys after storing user: %s", sorted(request.session.keys()))
 
             # Post login action
             post_login_action = request.session.get("post_login_action")
@@ -689,7 +2721,7 @@ async def auth_callback(request: Request):
                 # Store token with project
                 set_project_token(request, post_login_project, access_token, refresh_token)
                 request.session["current_project"] = post_login_project
-                print(f"Post-login VDI connect for {username}/{post_login_project}", flush=True)
+                logger.info("Post-login VDI connect for %s/%s", username, post_login_project)
 
                 # Redirect with auto-connect
                 return RedirectResponse(f"/vdi/status/{username}/{post_login_project}?auto_connect=true")
@@ -699,11 +2731,7 @@ async def auth_callback(request: Request):
             raise Exception(f"Userinfo request failed: {response.status_code} - {response.text}")
 
     except Exception as e:
-        print(f"Auth callback error: {e}", flush=True)
-        print(f"Error type: {type(e).__name__}", flush=True)
-        print(f"Error details: {repr(e)}", flush=True)
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}", flush=True)
+        logger.exception("Auth callback error: %s", e)
         request.session.clear()
         return RedirectResponse("/")
 
@@ -718,9 +2746,7 @@ async def logout(request: Request):
 
     request.session.clear()
     
-    if username in active_user_sessions:
-        del active_user_sessions[username]
-    
+    await _forget_auth_handles(request)
     await revoke_user_tokens(username, token, refresh_token)
     response = RedirectResponse("/logged-out")
     response.delete_cookie("k8tre-session")
@@ -735,28 +2761,25 @@ async def logged_out(request: Request):
 async def revoke_user_tokens(username, token=None, refresh_token=None):
     """ Revoke tokens for a specific user
     """
+    active_user_sessions.end(username)
+    _forget_guac_tokens(username)
+    token_refresher.forget(username)
     try:
-        async with httpx.AsyncClient(verify=False) as client:
-            if token:
-                await client.post(
-                    f"{internal_base}/protocol/openid-connect/revoke",
-                    data={
-                        "token": token,
-                        "token_type_hint": "access_token",
-                        "client_id": os.environ["KEYCLOAK_CLIENT_ID"],
-                        "client_secret": os.environ["KEYCLOAK_CLIENT_SECRET"],
-                    }
-                )
-            if refresh_token:
-                await client.post(
-                    f"{internal_base}/protocol/openid-connect/revoke",
-                    data={
-                        "token": refresh_token,
-                        "token_type_hint": "refresh_token",
-                        "client_id": os.environ["KEYCLOAK_CLIENT_ID"],
-                        "client_secret": os.environ["KEYCLOAK_CLIENT_SECRET"],
-                    }
-                )
+        http = get_http_client("keycloak")
+        revocations = [
+            http.post(
+                f"{internal_base}/protocol/openid-connect/revoke",
+                data={
+                    "token": value,
+                    "token_type_hint": hint,
+                    "client_id": os.environ["KEYCLOAK_CLIENT_ID"],
+                    "client_secret": os.environ["KEYCLOAK_CLIENT_SECRET"],
+                }
+            )
+            for value, hint in ((token, "access_token"), (refresh_token, "refresh_token"))
+            if value
+        ]
+        await asyncio.gather(*revocations)
     except Exception as e:
         pass
 
@@ -778,8 +2801,6 @@ async def cleanup_session(request: Request):
             user_session.get("token"), 
             user_session.get("refresh_token")
         )
-        
-    del active_user_sessions[username]
 
     return {"status": "cleaned", "user": username}
 
@@ -797,8 +2818,7 @@ def api_context(
         raise HTTPException(status_code=403, detail="User mismatch")
 
     try:
-        user_cr = k8s_api.get_namespaced_custom_object(
-            "identity.k8tre.io", "v1alpha1", NAMESPACE, "users", username)
+        user_cr = _get_cr("users", username)
     except Exception as e:
         return JSONResponse({"error": f"User CR not found: {e}"}, status_code=404)
 
@@ -806,13 +2826,11 @@ def api_context(
     projects = {}
     for group_name in groups:
         try:
-            group_cr = k8s_api.get_namespaced_custom_object(
-                "identity.k8tre.io", "v1alpha1", NAMESPACE, "groups", group_name)
+            group_cr = _get_cr("groups", group_name)
 
             for proj in group_cr['spec'].get('projects', []):
                 if proj not in projects:
-                    proj_cr = k8s_api.get_namespaced_custom_object(
-                        "research.k8tre.io", "v1alpha1", NAMESPACE, "projects", proj)
+                    proj_cr = _get_cr("projects", proj)
                     projects[proj] = {
                         "name": proj,
                         "description": proj_cr['spec'].get('description', ''),
@@ -827,6 +2845,157 @@ def api_context(
         "projects": list(projects.values())
     }
 
+class CredentialResolver:
+    """ Resolve the token and project offered by an /auth/validate request in one pass.
+
+        Candidates are tried in priority order: query token, next= param, Authorization
+        header, nginx auth token header, project cookie, global cookie, session and
+        referer. Cookies are parsed once and each distinct token is verified at most
+        once per request, with the verified claims memoised for the final check.
+        Cookies holding a handle are resolved to its token, whose stored claims count
+        as verified.
+    """
+
+    def __init__(self, request: Request):
+        self.request = request
+        self.cookies = request.cookies
+        self._verified = {}
+
+    def verify(self, token):
+        """ Verify a token (at most once), raising HTTPException if it is invalid.
+        """
+        if token not in self._verified:
+            token_hash = hashlib.sha256(token.encode()).hexdigest()
+            if rejected_tokens.get(token_hash):
+                self._verified[token] = HTTPException(status_code=401, detail="Invalid token")
+            else:
+                try:
+                    with _timed("jwt"):
+                        self._verified[token] = verify_token(f"Bearer {token}")
+                except Exception as e:
+                    # Only remember tokens that will never verify (malformed, expired, bad
+                    # signature, audience or issuer), not ones whose signing key is missing
+                    if isinstance(e.__cause__, jwt.InvalidTokenError):
+                        rejected_tokens.set(token_hash, True)
+                    self._verified[token] = e
+        result = self._verified[token]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def _dereference(self, value):
+        """ Get the token for a cookie value, which is either the token or a handle for it
+        """
+        if not AUTH_HANDLE_PATTERN.match(value):
+            return value
+        entry = await _load_auth_handle(value)
+        if entry is None:
+            return None
+        self._verified.setdefault(entry["token"], entry["claims"])
+        return entry["token"]
+
+    def _is_valid(self, token, project):
+        """ Check a cookie token before choosing it, a cached decision counts as verified
+        """
+        if _get_auth_decision(token, project) is not None:
+            return True
+        try:
+            return bool(self.verify(token).get("preferred_username"))
+        except Exception:
+            return False
+
+    async def resolve(self, p, q, path, is_tunnel_endpoint):
+        """ Get (token, project) for the request, token is None if there is none.
+        """
+        request = self.request
+
+        # We'll get JWT from cookies/headers instead for proper authentication
+        if is_tunnel_endpoint:
+            token = None
+        else:
+            token = q.get("token", [None])[0]
+
+        project = q.get("project", [None])[0]
+        if not project:
+            project = self.cookies.get("k8tre-project", "")
+
+        if not token and path.startswith("/hub/login") and "next" in q:
+            np = urllib.parse.urlparse(q["next"][0])
+            same_host_or_path = (not np.netloc) or (np.netloc == p.netloc)
+            if same_host_or_path and np.path.startswith(("/hub", "/user/")):
+                nq = urllib.parse.parse_qs(np.query)
+                token = token or (nq.get("token") or [None])[0]
+                project = project or (nq.get("project") or [""])[0]
+                logger.debug("Using token from next= param")
+
+        # If not available, try from Authorization header for every path
+        if not token:
+            ah = request.headers.get("authorization", "")
+            if ah.startswith("Bearer "):
+                token = ah.split(" ", 1)[1]
+                logger.debug("Using token from Authorization header")
+
+        # Project from nginx-forwarded project cookie header
+        if not project:
+            project = request.headers.get("x-project-cookie", "")
+            if project:
+                logger.debug("Using project from nginx header: %s", project)
+
+        if not token:
+            auth_token_header = request.headers.get("x-auth-token-cookie")
+            if auth_token_header:
+                auth_token_header = await self._dereference(auth_token_header)
+            if auth_token_header and self._is_valid(auth_token_header, project):
+                token = auth_token_header
+                logger.debug("Using auth token from nginx header")
+
+        # Get project-specific auth token, then fall back to global auth token
+        if not token and project:
+            auth_cookie = self.cookies.get(f"k8tre-auth-token-{project}")
+            if auth_cookie:
+                auth_cookie = await self._dereference(auth_cookie)
+            if auth_cookie and self._is_valid(auth_cookie, project):
+                token = auth_cookie
+                logger.debug("Using project-specific token in project %s", project)
+
+        if not token:
+            auth_cookie = self.cookies.get("k8tre-auth-token")
+            if auth_cookie:
+                auth_cookie = await self._dereference(auth_cookie)
+            if auth_cookie and self._is_valid(auth_cookie, project):
+                token = auth_cookie
+                logger.debug("Using global token (backward compat)")
+
+        # If not available, try from server side session via cookie
+        if not token:
+            if project:
+                token = get_token_for_project(request, project)
+                if token:
+                    logger.debug("Using session project-specific token for project %s", project)
+
+            # Fallback to global session token
+            if not token:
+                token = request.session.get("token")
+                if token:
+                    logger.debug("Using global session token (backward compat)")
+
+        if not token:
+            referer = request.headers.get("referer", "")
+            if referer:
+                try:
+                    parsed_referer = urllib.parse.urlparse(referer)
+                    referer_query = urllib.parse.parse_qs(parsed_referer.query)
+                    token = referer_query.get("token", [None])[0]
+
+                    # Also get project from referer if not already set
+                    if not project:
+                        project = referer_query.get("project", [None])[0]
+                except Exception as e:
+                    logger.debug("Failed to parse referer: %s", e)
+
+        return token, project
+
+
 @app.get("/auth/validate")
 async def auth_validate(request: Request):
     """ Function to validate each subsequent requests from application against keycloak or
@@ -854,164 +3023,60 @@ async def auth_validate(request: Request):
     q = urllib.parse.parse_qs(p.query)
     path = p.path
 
-    print(f"Auth/validate original: {original}", flush=True)
+    logger.debug("Auth/validate original path: %s", path, extra={"event": "auth.validate"})
 
     # Special handling for Guacamole tunnel endpoints
     # These use Guacamole's auth token in query params, not JWT
     is_tunnel_endpoint = path.startswith("/guacamole/tunnel") or path.startswith("/guacamole/websocket-tunnel")
     if is_tunnel_endpoint:
-        print(f"Tunnel endpoint detected: {path}", flush=True)
-        print(f"  Headers: x-auth-token-cookie={request.headers.get('x-auth-token-cookie', 'NOT PRESENT')}", flush=True)
-        print(f"  Cookie header: {request.headers.get('cookie', 'NOT PRESENT')[:100]}", flush=True)
-        print(f"  Authorization: {request.headers.get('authorization', 'NOT PRESENT')}", flush=True)
+        logger.debug("Tunnel endpoint detected: %s (x-auth-token-cookie: %s, cookie: %s, authorization: %s)", path, "x-auth-token-cookie" in request.headers, "cookie" in request.headers, "authorization" in request.headers)
 
     # Allowlisted static
     if is_static_resource(original):
+        AUTH_VALIDATE_OUTCOMES.labels("static").inc()
         return Response(status_code=200)
 
-    # We'll get JWT from cookies/headers instead for proper authentication
-    if is_tunnel_endpoint:
-        token = None
-    else:
-        token = q.get("token", [None])[0]
-
-    project = q.get("project", [None])[0]
-    if not project:
-        project = request.cookies.get("k8tre-project", "")
-    
-    if not token and path.startswith("/hub/login") and "next" in q:
-        np = urllib.parse.urlparse(q["next"][0])
-        same_host_or_path = (not np.netloc) or (np.netloc == p.netloc)
-        if same_host_or_path and np.path.startswith(("/hub", "/user/")):
-            nq = urllib.parse.parse_qs(np.query)
-            token = token or (nq.get("token") or [None])[0]
-            project = project or (nq.get("project") or [""])[0]
-            print("Using token from next= param", flush=True)
-
-    # If not available, try from Authorization header for every path
-    if not token:
-        ah = request.headers.get("authorization", "")
-        if ah.startswith("Bearer "):
-            token = ah.split(" ", 1)[1]
-            print("Using token from Authorization header", flush=True)
-
-    if not token:
-        auth_token_header = request.headers.get("x-auth-token-cookie")
-        if auth_token_header:
-            try:
-                # Verify the cookie token is valid
-                claims = verify_token(f"Bearer {auth_token_header}")
-                username = claims.get("preferred_username")
-                if username:
-                    token = auth_token_header
-                    print(f"Using auth token from nginx header for user: {username}", flush=True)
-            except Exception as e:
-                print(f"Auth token header verification failed: {e}", flush=True)
-
-    # Project from nginx-forwarded project cookie header
-    if not project:
-        project_header = request.headers.get("x-project-cookie")
-        if project_header:
-            project = project_header
-            print(f"Using project from nginx header: {project}", flush=True)
-
-    if not token or not project:
-        cookie_header = request.headers.get("cookie", "")
-        if cookie_header:
-            # Parse cookies manually
-            cookies = {}
-            for cookie_pair in cookie_header.split(';'):
-                cookie_pair = cookie_pair.strip()
-                if '=' in cookie_pair:
-                    key, value = cookie_pair.split('=', 1)
-                    cookies[key.strip()] = value.strip()
-
-            # Get project if possible
-            if not project and 'k8tre-project' in cookies:
-                project = cookies['k8tre-project']
-                print(f"Found project from cookie: {project}", flush=True)
-
-            # Get project-specific auth token
-            if not token and project:
-                project_token_cookie = f'k8tre-auth-token-{project}'
-                if project_token_cookie in cookies:
-                    auth_cookie = cookies[project_token_cookie]
-                    try:
-                        claims = verify_token(f"Bearer {auth_cookie}")
-                        username = claims.get("preferred_username")
-                        if username:
-                            token = auth_cookie
-                            print(f"Using project-specific token for {username} in project {project}", flush=True)
-                    except Exception as e:
-                        print(f"Project-specific cookie auth token verification failed: {e}", flush=True)
-
-            # Fallback to global auth token
-            if not token and 'k8tre-auth-token' in cookies:
-                auth_cookie = cookies['k8tre-auth-token']
-                try:
-                    claims = verify_token(f"Bearer {auth_cookie}")
-                    username = claims.get("preferred_username")
-                    if username:
-                        token = auth_cookie
-                        print(f"Using global token for {username} (backward compat)", flush=True)
-                except Exception as e:
-                    print(f"Cookie auth token verification failed: {e}", flush=True)
-
-    # If not available, try from server side session via cookie
-    if not token:
-        if project:
-            token = get_token_for_project(request, project)
-            if token:
-                print(f"Using session project-specific token for project {project}", flush=True)
-
-        # Fallback to global session token
-        if not token:
-            token = request.session.get("token")
-            if token:
-                print("Using global session token (backward compat)", flush=True)
-
-    if not token:
-        referer = request.headers.get("referer", "")
-        if referer:
-            try:
-                parsed_referer = urllib.parse.urlparse(referer)
-                referer_query = urllib.parse.parse_qs(parsed_referer.query)
-                token = referer_query.get("token", [None])[0]
-
-                # Also get project from referer if not already set
-                if not project:
-                    project = referer_query.get("project", [None])[0]
-            except Exception as e:
-                print(f"Failed to parse referer: {e}", flush=True)
+    # Find the token and project offered by the request, each distinct token is verified at most once
+    resolver = CredentialResolver(request)
+    token, project = await resolver.resolve(p, q, path, is_tunnel_endpoint)
 
     if (path.startswith("/hub") or path.startswith("/user/")) and not token:
-        print("Hub path without query token -> 401", flush=True)
+        logger.debug("Hub path without query token -> 401", extra={"event": "auth.validate.unauthenticated"})
+        AUTH_VALIDATE_OUTCOMES.labels("401").inc()
         return Response(status_code=401)
 
     if not token:
-        print("No token found -> 401", flush=True)
+        logger.debug("No token found -> 401", extra={"event": "auth.validate.unauthenticated"})
+        AUTH_VALIDATE_OUTCOMES.labels("401").inc()
         return Response(status_code=401)
 
-    # Verify JWT
-    claims = verify_token(f"Bearer {token}")
-    username = claims.get("preferred_username", "")
-
     if (path.startswith("/hub") or path.startswith("/user/")) and not project:
-        print("Hub path missing ?project= -> 401", flush=True)
+        logger.debug("Hub path missing ?project= -> 401", extra={"event": "auth.validate.unauthenticated"})
+        AUTH_VALIDATE_OUTCOMES.labels("401").inc()
         return Response(status_code=401)
 
-    # Authorization check: Verify user has access to the requested project
-    if project:
-        if not _is_user_authorised_project(username, project):
-            print(f"AUTHORISATION DENIED: User {username} attempted to access project {project} without permission", flush=True)
-            return Response(status_code=403)
+    # Reuse a recent decision for this token and project, otherwise verify JWT
+    # and check the user has access to the requested project
+    decision = _get_auth_decision(token, project)
+    if decision is None:
+        try:
+            claims = resolver.verify(token)
+        except HTTPException as e:
+            AUTH_VALIDATE_OUTCOMES.labels(str(e.status_code)).inc()
+            raise
+        username = claims.get("preferred_username", "")
+        version = entitlements.version(username)
+        authorised = not project or await _authorise_project(username, project)
+        decision = _set_auth_decision(token, project, claims, authorised, version)
+
+    if not decision["authorised"]:
+        logger.warning("AUTHORISATION DENIED: User %s attempted to access project %s without permission", decision["username"], project, extra={"event": "auth.validate.denied"})
+        AUTH_VALIDATE_OUTCOMES.labels("403").inc()
+        return Response(status_code=403)
 
     # Creating all the headers that we needed for nginx annotations and authentication.
     headers = {
-        "Remote-User": claims.get("preferred_username", ""),
-        "X-Auth-User": claims.get("preferred_username", ""),
-        "X-Auth-Email": claims.get("email", ""),
-        "X-Auth-Groups": ",".join(claims.get("groups", []) or []),
+        **decision["headers"],
         "X-Auth-Project": project,
         "Authorization": f"Bearer {token}",
         "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
@@ -1025,8 +3090,130 @@ async def auth_validate(request: Request):
         headers["X-Auth-Signature"] = sig
         headers["X-Auth-Audience"] = aud
 
+    # traceparent/tracestate, for the auth proxy to pass on to the application
+    propagate.inject(headers)
+
+    AUTH_VALIDATE_OUTCOMES.labels("200").inc()
     return Response(status_code=200, headers=headers)
 
+AUTH_DECISION_CACHE_TTL = int(os.environ.get("AUTH_DECISION_CACHE_TTL", "30"))
+AUTH_DECISION_CACHE_SIZE = int(os.environ.get("AUTH_DECISION_CACHE_SIZE", "10000"))
+auth_decisions = TTLCache(AUTH_DECISION_CACHE_SIZE, AUTH_DECISION_CACHE_TTL, name="auth_decisions")
+# Tokens that can never verify, e.g. expired tokens still held in a cookie
+rejected_tokens = TTLCache(AUTH_DECISION_CACHE_SIZE, AUTH_DECISION_CACHE_TTL, name="rejected_tokens")
+
+# With K8TRE_AUTH_COOKIE_HANDLES the k8tre-auth-token-{project} cookies hold an opaque
+# handle instead of the JWT, resolved here to the token and its verified claims. Handles
+# are kept with the sessions, in Redis when SESSION_STORE=redis so any replica can
+# resolve them, otherwise in this process. They are not cached per replica, so a
+# handle dropped at logout stops working everywhere at once.
+AUTH_COOKIE_HANDLES = os.environ.get("K8TRE_AUTH_COOKIE_HANDLES", "false").lower() == "true"
+AUTH_HANDLE_TTL = int(os.environ.get("AUTH_HANDLE_TTL", "3600"))
+AUTH_HANDLE_PATTERN = re.compile(r"^[A-Za-z0-9_-]{43}$")
+
+
+def _create_auth_handle_store():
+    if isinstance(session_store, RedisSessionStore):
+        return RedisSessionStore(session_store.redis, AUTH_HANDLE_TTL, prefix="k8tre:auth-handle:")
+    return MemorySessionStore(SESSION_STORE_MAX_SESSIONS, AUTH_HANDLE_TTL)
+
+
+auth_handle_store = _create_auth_handle_store()
+
+
+async def _issue_auth_handle(request, project, token, claims):
+    """ Get a handle for the project token to set in place of it. The handle the
+        browser already holds for the project is kept when it is the same user's.
+    """
+    username = claims.get("preferred_username", "")
+    handle = request.cookies.get(f"k8tre-auth-token-{project}", "")
+    current = await _load_auth_handle(handle) if AUTH_HANDLE_PATTERN.match(handle) else None
+    if not current or current["username"] != username or current["project"] != project:
+        handle = secrets.token_urlsafe(32)
+    entry = {"username": username, "project": project, "token": token, "claims": claims}
+    await auth_handle_store.save(handle, json.dumps(entry))
+    return handle
+
+
+async def _load_auth_handle(handle):
+    """ Get the {username, project, token, claims} a handle stands for, None if the
+        handle is unknown, its token has expired or the store is unavailable.
+    """
+    try:
+        data = await auth_handle_store.load(handle)
+    except RedisError as e:
+        logger.warning("Auth handle store unavailable: %s", e)
+        return None
+    if not data:
+        return None
+    entry = json.loads(data)
+    if entry["claims"].get("exp", 0) <= time.time():
+        return None
+    return entry
+
+
+async def _forget_auth_handles(request):
+    """ Drop the handles held in the request's k8tre-auth-token-{project} cookies
+    """
+    for name, value in request.cookies.items():
+        if name.startswith("k8tre-auth-token-") and AUTH_HANDLE_PATTERN.match(value):
+            try:
+                await auth_handle_store.delete(value)
+            except RedisError as e:
+                logger.warning("Auth handle store unavailable, handle not dropped: %s", e)
+
+
+async def _auth_cookie_value(request, project, token, claims=None):
+    """ Value for the k8tre-auth-token-{project} cookie, the token or a handle for it.
+        The token itself is set while the handle store is unavailable.
+    """
+    if not AUTH_COOKIE_HANDLES:
+        return token
+    if claims is None:
+        claims = verify_token(f"Bearer {token}")
+    try:
+        return await _issue_auth_handle(request, project, token, claims)
+    except RedisError as e:
+        logger.warning("Auth handle store unavailable, setting the token cookie: %s", e)
+        return token
+
+
+def _auth_decision_key(token, project):
+    """ Cache key for an authorisation decision, the token itself is never stored
+    """
+    return hashlib.sha256(f"{token}|{project}".encode()).hexdigest()
+
+
+def _get_auth_decision(token, project):
+    """ Get a cached /auth/validate decision for this token and project, ignoring it
+        if the user's project entitlements changed since it was made.
+    """
+    decision = auth_decisions.get(_auth_decision_key(token, project))
+    if decision and decision["version"] != entitlements.version(decision["username"]):
+        return None
+    return decision
+
+
+def _set_auth_decision(token, project, claims, authorised, version):
+    """ Cache an /auth/validate decision, never beyond the token's own expiry.
+        version is the user's entitlement version from before the check was made.
+    """
+    username = claims.get("preferred_username", "")
+    decision = {
+        "username": username,
+        "authorised": authorised,
+        "headers": {
+            "Remote-User": username,
+            "X-Auth-User": username,
+            "X-Auth-Email": claims.get("email", ""),
+            "X-Auth-Groups": ",".join(claims.get("groups", []) or []),
+        },
+        "version": version,
+    }
+    auth_decisions.set(_auth_decision_key(token, project), decision, expires_at=claims.get("exp"))
+    return decision
+
+
 def is_static_resource(url, config=None):
     """ To identify whether a request is for static, non-authenticated urls
         Eg: Call to access icons, internal API calls etc.
@@ -1086,8 +3273,7 @@ def get_projects(request: Request, user=Depends(require_user)):
     # user's groups
     username = user["preferred_username"]
     try:
-        user_cr = k8s_api.get_namespaced_custom_object(
-            "identity.k8tre.io", "v1alpha1", NAMESPACE, "users", username)
+        projects = _get_user_projects(username)
     except Exception as e:
         return templates.TemplateResponse("error.html", {"request": request, "error": f"User CR not found: {e}"})
 
@@ -1095,26 +3281,15 @@ def get_projects(request: Request, user=Depends(require_user)):
     vdi_context = request.session.get("vdi_context", False)
     vdi_project = request.session.get("vdi_project")
 
-    groups = user_cr['spec'].get('groups', [])
-    projects = set()
-    for group_name in groups:
-        try:
-            group_cr = k8s_api.get_namespaced_custom_object(
-                "identity.k8tre.io", "v1alpha1", NAMESPACE, "groups", group_name)
-            projects.update(group_cr['spec'].get('projects', []))
-        except Exception:
-            continue
-
     # Filter projects if in VDI context
     if vdi_context and vdi_project:
         projects = {vdi_project} if vdi_project in projects else set()
-        print(f"VDI context detected, filtering to project: {vdi_project}", flush=True)
+        logger.debug("VDI context detected, filtering to project: %s", vdi_project)
 
     project_objs = []
     for proj in projects:
         try:
-            project = k8s_api.get_namespaced_custom_object(
-                "research.k8tre.io", "v1alpha1", NAMESPACE, "projects", proj)
+            project = _get_cr("projects", proj)
             project_objs.append({
                 "name": proj,
                 "description": project['spec'].get('description', '')
@@ -1137,15 +3312,14 @@ def get_apps(project: str, request: Request, user=Depends(require_user)):
     vdi_context = request.session.get("vdi_context", False)
     vdi_project = request.session.get("vdi_project")
     if vdi_context and vdi_project and project != vdi_project:
-        print(f"BLOCKED: User in VDI context (project: {vdi_project}) attempting to view apps for project: {project}", flush=True)
+        logger.warning("BLOCKED: User in VDI context (project: %s) attempting to view apps for project: %s", vdi_project, project)
         return templates.TemplateResponse(
             "project-restricted.html",
             {"request": request, "vdi_project": vdi_project, "requested_project": project}
         )
 
     try:
-        project_cr = k8s_api.get_namespaced_custom_object(
-            "research.k8tre.io", "v1alpha1", NAMESPACE, "projects", project)
+        project_cr = _get_cr("projects", project)
         apps = project_cr['spec'].get('apps', [])
         return templates.TemplateResponse(
             "apps.html",
@@ -1160,16 +3334,13 @@ def get_projects_internal():
     """ List all project names for internal use
     """
     try:
-        project_list = k8s_api.list_namespaced_custom_object(
-            "research.k8tre.io", "v1alpha1", NAMESPACE, "projects"
-        )
-        projects = [{"name": p["metadata"]["name"]} for p in project_list.get("items", [])]
+        projects = [{"name": p["metadata"]["name"]} for p in _list_crs("projects")]
         return {"projects": projects}
     except ApiException as e:
-        print(f"K8s API error listing projects: {e}", flush=True)
+        logger.error("K8s API error listing projects: %s", e)
         raise HTTPException(status_code=e.status, detail=f"Failed to list projects: {e.reason}")
     except Exception as e:
-        print(f"Unexpected error listing projects: {e}", flush=True)
+        logger.exception("Unexpected error listing projects: %s", e)
         raise HTTPException(status_code=500, detail="Failed to list projects")
 
 @app.get("/internal/projects/{project}/profiles", dependencies=[Depends(verify_internal_token)])
@@ -1178,16 +3349,14 @@ def get_profiles_internal(project: str):
         It is mainly used for jupyterhub custom spawn
     """
     try:
-        print(f"Fetching profiles for project: {project}", flush=True)
-        project_cr = k8s_api.get_namespaced_custom_object(
-            "research.k8tre.io", "v1alpha1", NAMESPACE, "projects", project
-        )
+        logger.debug("Fetching profiles for project: %s", project)
+        project_cr = _get_cr("projects", project)
         profiles = project_cr['spec'].get('profiles', [])
-        print(f"Profiles for project '{project}': {profiles}", flush=True)
+        logger.debug("Profiles for project %r: %s", project, profiles)
         return JSONResponse(content={"profiles": profiles})
     
     except Exception as e:
-        print(f"Error fetching profiles for project '{project}': {e}", flush=True)
+        logger.warning("Error fetching profiles for project %r: %s", project, e)
         return JSONResponse(
             {"error": f"Project not found: {e}"}, 
             status_code=404
@@ -1206,29 +3375,30 @@ async def sso_redirect(
         username = claims.get("preferred_username")
         email = claims.get("email", "")
 
-        print(f"SSO authentication for user: {username}, project: {project}, app: {app}", flush=True)
+        logger.info("SSO authentication for user: %s, project: %s, app: %s", username, project, app)
 
-        # Verify user access
-        if not _is_user_authorised_project(username, project):
-            print(f"AUTHORISATION DENIED: User {username} attempted SSO to project {project} without permission", flush=True)
+        # Verify user access and check if request coming from VDI pod, these are independent
+        authorised, (is_from_vdi, detected_project) = await asyncio.gather(
+            _authorise_project(username, project),
+            _detect_vdi_pod(request, username),
+        )
+        if not authorised:
+            logger.warning("AUTHORISATION DENIED: User %s attempted SSO to project %s without permission", username, project)
             raise HTTPException(status_code=403, detail=f"Access denied to project {project}")
 
         # Store token in session for project
         set_project_token(request, project, token)
 
-        # Check if request coming from VDI pod
-        is_from_vdi, detected_project = _is_request_vdi_pod(request, username)
-
         if is_from_vdi and detected_project:
             # Restrict to that project only
             request.session["vdi_context"] = True
             request.session["vdi_project"] = detected_project
-            print(f"SSO: User {username} accessing from inside VDI (project: {detected_project})", flush=True)
+            logger.debug("SSO: User %s accessing from inside VDI (project: %s)", username, detected_project)
         else:
             # Full portal access
             request.session["vdi_context"] = False
             request.session.pop("vdi_project", None)
-            print(f"SSO: User {username} accessing from host", flush=True)
+            logger.debug("SSO: User %s accessing from host", username)
 
         # Build redirect URL based on app
         if app == "jupyter":
@@ -1255,7 +3425,7 @@ async def sso_redirect(
         # Set project-scoped auth token
         response.set_cookie(
             f"k8tre-auth-token-{project}",
-            token,
+            await _auth_cookie_value(request, project, token, claims),
             samesite="lax",
             secure=False,
             httponly=True,
@@ -1264,11 +3434,11 @@ async def sso_redirect(
             path="/"
         )
 
-        print(f"SSO cookies set for {username} project {project}, redirecting to {redirect_url}", flush=True)
+        logger.info("SSO cookies set for %s project %s, redirecting to %s", username, project, urlparse(redirect_url)._replace(query="").geturl())
         return response
 
     except Exception as e:
-        print(f"SSO authentication failed: {e}", flush=True)
+        logger.warning("SSO authentication failed: %s", e)
         raise HTTPException(status_code=401, detail=f"SSO authentication failed: {e}")
 
 @app.get("/launch/{project}/{app}")
@@ -1277,13 +3447,13 @@ async def launch_app(project: str, app: str, request: Request, user=Depends(requ
     """
     username = user["preferred_username"]
     email = user.get("email", "")
-    print(f"Launching {app} for user {username} in project {project}", flush=True)
+    logger.info("Launching %s for user %s in project %s", app, username, project)
 
     # Prevent VDI from VDI
     vdi_context = request.session.get("vdi_context", False)
     vdi_project = request.session.get("vdi_project")
     if vdi_context and app in ["vdi", "guacamole"]:
-        print(f"WARNING: User attempting to launch VDI from within VDI (project: {vdi_project})", flush=True)
+        logger.warning("User attempting to launch VDI from within VDI (project: %s)", vdi_project)
         return templates.TemplateResponse(
             "vdi-warning.html",
             {"request": request, "project": vdi_project}
@@ -1291,16 +3461,22 @@ async def launch_app(project: str, app: str, request: Request, user=Depends(requ
 
     # Prevent access to other projects
     if vdi_context and vdi_project and project != vdi_project:
-        print(f"BLOCKED: User in VDI context (project: {vdi_project}) attempting to access different project: {project}", flush=True)
+        logger.warning("BLOCKED: User in VDI context (project: %s) attempting to access different project: %s", vdi_project, project)
         return templates.TemplateResponse(
             "project-restricted.html",
             {"request": request, "vdi_project": vdi_project, "requested_project": project}
         )
 
-    # Get or refresh project token
-    valid_token = await ensure_valid_token(request, project=project)
+    # Get or refresh project token, while the project CR is read
+    valid_token, project_cr = await asyncio.gather(
+        ensure_valid_token(request, project=project),
+        _run_k8s(_get_cr, "projects", project),
+        return_exceptions=True
+    )
+    if isinstance(valid_token, Exception):
+        raise valid_token
     if not valid_token:
-        print(f"No valid token available for project {project}, redirecting to login", flush=True)
+        logger.info("No valid token available for project %s, redirecting to login", project)
         return RedirectResponse("/login")
 
     # Get project refresh token
@@ -1311,8 +3487,8 @@ async def launch_app(project: str, app: str, request: Request, user=Depends(requ
     request.session["user"] = user
 
     try:
-        project_cr = k8s_api.get_namespaced_custom_object(
-            "research.k8tre.io", "v1alpha1", NAMESPACE, "projects", project)
+        if isinstance(project_cr, Exception):
+            raise project_cr
         app_cfg = next((a for a in project_cr['spec'].get('apps', []) if a['name'] == app), None)
 
         if not app_cfg:
@@ -1325,7 +3501,8 @@ async def launch_app(project: str, app: str, request: Request, user=Depends(requ
                 "kind": "VDIInstance",
                 "metadata": {
                     "name": vdi_name,
-                    "namespace": get_proj_namespace(project)
+                    "namespace": get_proj_namespace(project),
+                    "labels": _vdi_labels(username, project)
                 },
                 "spec": {
                     "user": username,
@@ -1345,10 +3522,10 @@ async def launch_app(project: str, app: str, request: Request, user=Depends(requ
                 }
             }
 
-            crd_client = client.CustomObjectsApi()
             vdi_created = False
             try:
-                crd_client.create_namespaced_custom_object(
+                await _run_k8s(
+                    k8s_api.create_namespaced_custom_object,
                     group="k8tre.io",
                     version="v1alpha1",
                     namespace=get_proj_namespace(project),
@@ -1356,16 +3533,17 @@ async def launch_app(project: str, app: str, request: Request, user=Depends(requ
                     body=vdi_spec
                 )
                 vdi_created = True
-                print(f"Created new VDI instance: {vdi_name}", flush=True)
+                logger.info("Created new VDI instance: %s", vdi_name)
             except ApiException as e:
                 if e.status == 409:
-                    print(f"VDI instance {vdi_name} already exists", flush=True)
+                    logger.info("VDI instance %s already exists", vdi_name)
+                    await _run_k8s(_label_vdi_instance, vdi_name, username, project)
                 else:
                     raise
 
             # Redirect to status page - it will wait for VDI to be ready
             status_url = build_service_url("portal", f"/vdi/status/{username}/{project}")
-            print(f"Redirecting to status page: {status_url}", flush=True)
+            logger.debug("Redirecting to status page: %s", status_url)
             return RedirectResponse(status_url)
 
         # For Jupyter and other apps
@@ -1392,7 +3570,7 @@ async def launch_app(project: str, app: str, request: Request, user=Depends(requ
         # Set project-scoped auth token
         resp.set_cookie(
             f"k8tre-auth-token-{project}",
-            valid_token,
+            await _auth_cookie_value(request, project, valid_token),
             samesite="lax",
             secure=False,
             httponly=True,
@@ -1406,12 +3584,14 @@ async def launch_app(project: str, app: str, request: Request, user=Depends(requ
         resp.delete_cookie("jupyterhub-session-id", domain=cookie_domain, path="/")
         resp.delete_cookie("_xsrf", domain=cookie_domain, path="/")
 
-        print(f"Redirecting for project {project} with scoped token", flush=True)
+        logger.debug("Redirecting for project %s with scoped token", project)
         return resp
 
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        # An invalid token (e.g. while issuing its handle) is a 401 as from verify_token
+        if isinstance(e, HTTPException) and e.status_code == 401:
+            raise
+        logger.exception("Launching %s for user %s in project %s failed: %s", app, username, project, e)
         raise HTTPException(status_code=404, detail=f"Project/app not found: {e}")
 
 @app.get("/api/projects")
@@ -1420,33 +3600,22 @@ def get_projects_json(request: Request, user=Depends(require_user)):
     """
     username = user["preferred_username"]
     try:
-        user_cr = k8s_api.get_namespaced_custom_object(
-            "identity.k8tre.io", "v1alpha1", NAMESPACE, "users", username)
+        projects = _get_user_projects(username)
     except Exception as e:
         return JSONResponse({"error": f"User CR not found: {e}"}, status_code=404)
 
     vdi_context = request.session.get("vdi_context", False)
     vdi_project = request.session.get("vdi_project")
-    groups = user_cr['spec'].get('groups', [])
-    projects = set()
-    for group_name in groups:
-        try:
-            group_cr = k8s_api.get_namespaced_custom_object(
-                "identity.k8tre.io", "v1alpha1", NAMESPACE, "groups", group_name)
-            projects.update(group_cr['spec'].get('projects', []))
-        except Exception:
-            continue
 
     # Filter projects if in VDI context
     if vdi_context and vdi_project:
         projects = {vdi_project} if vdi_project in projects else set()
-        print(f"API: VDI context detected, filtering to project: {vdi_project}", flush=True)
+        logger.debug("API: VDI context detected, filtering to project: %s", vdi_project)
 
     project_objs = []
     for proj in projects:
         try:
-            project = k8s_api.get_namespaced_custom_object(
-                "research.k8tre.io", "v1alpha1", NAMESPACE, "projects", proj)
+            project = _get_cr("projects", proj)
             project_objs.append({
                 "name": proj,
                 "description": project['spec'].get('description', '')
@@ -1464,15 +3633,14 @@ def get_apps_json(project: str, request: Request, user=Depends(require_user)):
     vdi_project = request.session.get("vdi_project")
 
     if vdi_context and vdi_project and project != vdi_project:
-        print(f"API BLOCKED: User in VDI context (project: {vdi_project}) attempting to access apps for project: {project}", flush=True)
+        logger.warning("API BLOCKED: User in VDI context (project: %s) attempting to access apps for project: %s", vdi_project, project)
         return JSONResponse(
             {"error": f"Cannot access project '{project}' from within VDI session for project '{vdi_project}'"},
             status_code=403
         )
 
     try:
-        project_cr = k8s_api.get_namespaced_custom_object(
-            "research.k8tre.io", "v1alpha1", NAMESPACE, "projects", project)
+        project_cr = _get_cr("projects", project)
         return {"apps": project_cr['spec'].get('apps', []), "vdi_context": vdi_context}
     except Exception as e:
         return JSONResponse({"error": f"Project not found: {e}"}, status_code=404)
@@ -1483,10 +3651,7 @@ def get_all_groups():
     """
     groups = []
     try:
-        group_cr_list = k8s_api.list_namespaced_custom_object(
-            "identity.k8tre.io", "v1alpha1", NAMESPACE, "groups"
-        )
-        for group_cr in group_cr_list.get("items", []):
+        for group_cr in _list_crs("groups"):
             groups.append(group_cr["metadata"]["name"])
     except Exception as e:
         return JSONResponse({"error": f"Failed to fetch groups: {e}"}, status_code=500)
@@ -1517,6 +3682,10 @@ async def vdi_logout(request: Request, project: str = Query(None)):
     if not project:
         project = request.session.get("current_project")
 
+    # Guacamole invalidated the token of the session that ended, never hand it out again
+    if username and project:
+        guac_tokens.pop((username, project))
+
     # Get user and project from session
     # Check token validity
     if username and project:
@@ -1524,13 +3693,13 @@ async def vdi_logout(request: Request, project: str = Query(None)):
 
         if valid_token:
             # Valid and redirection
-            print(f"VDI logout: Session valid for {username}/{project}, redirecting to status page", flush=True)
+            logger.info("VDI logout: Session valid for %s/%s, redirecting to status page", username, project)
             status_url = build_service_url("portal", f"/vdi/status/{username}/{project}?auto_connect=true")
             return RedirectResponse(status_url)
 
     # Expired/invalid session
     # Redirect to login with return path
-    print(f"VDI logout: Session invalid or expired, redirecting to login", flush=True)
+    logger.info("VDI logout: Session invalid or expired, redirecting to login")
 
     if username and project:
         request.session["post_login_action"] = "vdi_connect"
@@ -1554,69 +3723,157 @@ async def vdi_status_page(username: str, project: str, request: Request, auto_co
     )
 
 
-@app.get("/api/vdi/status/{username}/{project}")
-async def get_vdi_status(username: str, project: str, user=Depends(require_user)):
-    """ Get VDI instance status for polling
+async def _read_service_ready(namespace, service_name):
+    """ Whether a service has ready endpoints, read from the API for when the
+        EndpointSlice informer is not synced
     """
-    current_user = user.get("preferred_username")
-    if current_user != username:
-        raise HTTPException(status_code=403, detail="Access denied")
+    try:
+        endpoints = await _run_k8s(
+            k8s_core_api.read_namespaced_endpoints,
+            name=service_name,
+            namespace=namespace
+        )
+        return any(subset.addresses for subset in endpoints.subsets or [])
+    except Exception as e:
+        logger.warning("Error checking endpoint readiness: %s", e)
+        return False
+
 
+async def _get_vdi_status(username, project):
+    """ Get the phase and readiness of a user's VDI instance, as reported by the
+        status endpoint and stream. Raises ApiException (404) if it does not exist.
+    """
     instance_name = f"{username}-{project}".lower()
+    namespace = get_proj_namespace(project)
 
-    try:
-        vdi_cr = k8s_api.get_namespaced_custom_object(
+    informer = vdi_informers["vdiinstances"]
+    if informer.synced:
+        vdi_cr = informer.get(instance_name, namespace)
+        if vdi_cr is None:
+            raise ApiException(status=404, reason=f"vdiinstances {instance_name} not found")
+    else:
+        vdi_cr = await _run_k8s(
+            k8s_api.get_namespaced_custom_object,
             group="k8tre.io",
             version="v1alpha1",
-            namespace=get_proj_namespace(project),
+            namespace=namespace,
             plural="vdiinstances",
             name=instance_name
         )
 
-        status = vdi_cr.get("status", {})
-        phase = status.get("phase", "Unknown")
-        has_password = bool(status.get("password"))
+    status = vdi_cr.get("status", {})
+    phase = status.get("phase", "Unknown")
+    has_password = bool(status.get("password"))
 
-        # Check if RDP port
-        is_ready = False
-        if phase in ("Running", "Ready") and has_password:
-            service_name = f"vdi-{username}-{project}"
-            hostname = f"{service_name}.{get_proj_namespace(project)}.svc.cluster.local"
+    # Check if RDP port
+    is_ready = False
+    if phase in ("Running", "Ready") and has_password:
+        service_name = f"vdi-{username}-{project}"
+        hostname = f"{service_name}.{namespace}.svc.cluster.local"
 
-            service_ready = False
-            try:
-                v1 = client.CoreV1Api()
-                endpoints = v1.read_namespaced_endpoints(
-                    name=service_name,
-                    namespace=get_proj_namespace(project)
-                )
-                if endpoints.subsets:
-                    for subset in endpoints.subsets:
-                        if subset.addresses:
-                            service_ready = True
-                            break
-            except Exception as e:
-                print(f"Error checking endpoint readiness: {e}", flush=True)
+        if service_readiness.ready:
+            service_ready = service_readiness.is_ready(namespace, service_name)
+        else:
+            service_ready = await _read_service_ready(namespace, service_name)
 
-            if service_ready:
-                try:
-                    with socket.create_connection((hostname, 3389), timeout=2):
-                        is_ready = True
-                except Exception as probe_err:
-                    print(f"TCP readiness probe failed: {probe_err}", flush=True)
-
-        return {
-            "phase": phase,
-            "has_password": has_password,
-            "is_ready": is_ready,
-            "name": instance_name
-        }
+        if service_ready:
+            is_ready = rdp_prober.is_ready((namespace, instance_name), hostname)
+
+    return {
+        "phase": phase,
+        "has_password": has_password,
+        "is_ready": is_ready,
+        "name": instance_name
+    }
+
+
+@app.get("/api/vdi/status/{username}/{project}")
+async def get_vdi_status(username: str, project: str, user=Depends(require_user)):
+    """ Get VDI instance status for polling
+    """
+    current_user = user.get("preferred_username")
+    if current_user != username:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    try:
+        return await _get_vdi_status(username, project)
     except client.exceptions.ApiException as e:
         if e.status == 404:
             return JSONResponse({"error": "VDI instance not found"}, status_code=404)
         return JSONResponse({"error": f"Failed to get VDI status: {e.reason}"}, status_code=e.status)
 
 
+VDI_STATUS_STREAM_TIMEOUT = int(os.environ.get("VDI_STATUS_STREAM_TIMEOUT", "300"))
+VDI_STATUS_RECHECK_INTERVAL = float(os.environ.get("VDI_STATUS_RECHECK_INTERVAL", "2"))
+VDI_STATUS_KEEPALIVE_INTERVAL = float(os.environ.get("VDI_STATUS_KEEPALIVE_INTERVAL", "15"))
+
+
+async def _vdi_status_events(request: Request, username, project):
+    """ Server-Sent Events of a VDI's status, a new event is sent on every change
+        until the desktop is ready or has failed.
+    """
+    instance_name = f"{username}-{project}".lower()
+    key = (get_proj_namespace(project), instance_name)
+    changes = vdi_status_broadcaster.subscribe(key)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + VDI_STATUS_STREAM_TIMEOUT
+    last = None
+    try:
+        while loop.time() < deadline and not await request.is_disconnected():
+            try:
+                payload = await _get_vdi_status(username, project)
+            except ApiException as e:
+                if e.status != 404:
+                    raise
+                # The instance may not have been seen by the watch yet
+                payload = {"phase": "Pending", "has_password": False, "is_ready": False, "name": instance_name}
+
+            if payload["is_ready"]:
+                # The user is watching the status page, the next step is connect
+                _schedule_guac_token(username, project)
+            if payload != last:
+                yield f"data: {json.dumps(payload)}\n\n"
+                last = payload
+            if payload["is_ready"] or payload["phase"] == "Failed":
+                return
+
+            # Phase, service and RDP port changes are pushed, service readiness is only
+            # rechecked when the EndpointSlice informer is not synced
+            running = payload["phase"] in ("Running", "Ready") and payload["has_password"]
+            if running and not service_readiness.ready:
+                timeout = VDI_STATUS_RECHECK_INTERVAL
+            else:
+                timeout = VDI_STATUS_KEEPALIVE_INTERVAL
+            try:
+                await asyncio.wait_for(changes.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+    except Exception as e:
+        logger.exception("VDI status stream for %s failed: %s", instance_name, e)
+        yield f"event: error\ndata: {json.dumps({'error': 'Failed to get VDI status'})}\n\n"
+    finally:
+        vdi_status_broadcaster.unsubscribe(key, changes)
+
+
+@app.get("/api/vdi/events/{username}/{project}")
+async def stream_vdi_status(username: str, project: str, request: Request, user=Depends(require_user)):
+    """ Stream VDI instance status changes (Server-Sent Events)
+        The status page falls back to polling if this is unavailable.
+    """
+    current_user = user.get("preferred_username")
+    if current_user != username:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    if not vdi_informers["vdiinstances"].synced:
+        return JSONResponse({"error": "VDI status stream unavailable"}, status_code=503)
+
+    return StreamingResponse(
+        _vdi_status_events(request, username, project),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/api/vdi/connect/{username}/{project}")
 async def connect_to_vdi(username: str, project: str, request: Request, user=Depends(require_user)):
     """ Generate Guacamole token and redirect to VDI
@@ -1626,32 +3883,17 @@ async def connect_to_vdi(username: str, project: str, request: Request, user=Dep
         raise HTTPException(status_code=403, detail="Access denied")
 
     # Build connections for this user
-    all_connections = _build_connections_for_user(username)
-    print(f"All connections for {username}: {list(all_connections.keys())}", flush=True)
-
-    project_connections = {
-        conn_id: conn_data
-        for conn_id, conn_data in all_connections.items()
-        if conn_id.startswith(f"{project}-")
-    }
-    print(f"Project connections for {project}: {list(project_connections.keys())}", flush=True)
+    project_connections = await _get_project_connections(username, project)
+    logger.debug("Project connections for %s: %s", project, list(project_connections.keys()))
 
     if not project_connections:
         raise HTTPException(status_code=404, detail=f"No VDI connection available for project {project}")
 
-    # Generate auth token
-    expiry_ms = int(time.time() * 1000) + 60_000
-    data = {
-        "username": username,
-        "expires": expiry_ms,
-        "connections": project_connections,
-    }
-    print(f"Guacamole token data: username={username}, connections={list(data['connections'].keys())}", flush=True)
-
-    auth_token = await _get_guac_auth_token(data)
+    # Usually pre-minted once the VDI became ready, used only once
+    auth_token = await _get_guac_token(username, project, project_connections)
     guacamole_url = build_service_url("guacamole")
     redirect_url = f"{guacamole_url}/guacamole/?token={auth_token}"
-    print(f"Redirecting to: {redirect_url}", flush=True)
+    logger.info("Redirecting %s to Guacamole for project %s", username, project)
 
     return RedirectResponse(redirect_url)
 
@@ -1681,7 +3923,8 @@ async def shutdown_vdi(request: Request, user=Depends(require_user)):
     form = await request.form()
     project = form.get("project")
     username = user["preferred_username"]
-    delete_vdi_instance(username=username, project=project)
+    await _run_k8s(delete_vdi_instance, username=username, project=project)
+    rdp_prober.forget((get_proj_namespace(project), f"{username}-{project}".lower()))
     return RedirectResponse("/vdi", status_code=302)
 
 @app.get("/vdi", response_class=HTMLResponse)
@@ -1693,7 +3936,7 @@ def get_vdi_instances(request: Request, user=Depends(require_user)):
     try:
         # Get all VDI instances for this user
         vdi_instances = []
-        vdi_items = _list_vdi_instances()
+        vdi_items = _list_vdi_instances(username=username)
 
         for vdi in vdi_items:
             spec = vdi.get("spec", {})
@@ -1740,23 +3983,12 @@ async def vdi_refresh_token(
         except:
             pass
         
-        # Use refresh token to get new access token
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.post(
-                f"{internal_base}/protocol/openid-connect/token",
-                data={
-                    "grant_type": "refresh_token",
-                    "refresh_token": refresh_token,
-                    "client_id": os.environ["KEYCLOAK_CLIENT_ID"],
-                    "client_secret": os.environ["KEYCLOAK_CLIENT_SECRET"],
-                },
-                headers={"Content-Type": "application/x-www-form-urlencoded"}
-            )
+        # Use refresh token to get new access token, shared only with callers holding the same refresh token
+        token_data = await token_refresher.refresh(refresh_token, project=project)
         
-        if response.status_code == 200:
-            token_data = response.json()
+        if token_data:
             new_access_token = token_data["access_token"]
-            new_refresh_token = token_data.get("refresh_token", refresh_token)
+            new_refresh_token = token_data["refresh_token"]
             
             return {
                 "token": new_access_token,
@@ -1768,7 +4000,7 @@ async def vdi_refresh_token(
             return JSONResponse({"error": "Token refresh failed"}, status_code=401)
             
     except Exception as e:
-        print(f"VDI token refresh error: {e}", flush=True)
+        logger.warning("VDI token refresh error: %s", e)
         return JSONResponse({"error": "Token refresh failed"}, status_code=401)
 
 @app.get("/api/refresh-token")
@@ -1797,3 +4029,40 @@ async def health_check():
     """ Health end point if it is reachable.
     """
     return {"status": "healthy", "service": "k8tre-portal"}
+
+
+class PortalCollector:
+    """ Gauges computed at scrape time from the in-memory state
+    """
+
+    def collect(self):
+        phases = GaugeMetricFamily(
+            "k8tre_portal_vdi_instances", "VDI instances by project and phase", labels=["project", "phase"]
+        )
+        if vdi_index.ready:
+            counts = {}
+            for vdi in vdi_index.all():
+                labels = (vdi.get("spec", {}).get("project", ""), vdi.get("status", {}).get("phase", "Unknown"))
+                counts[labels] = counts.get(labels, 0) + 1
+            for labels, count in counts.items():
+                phases.add_metric(list(labels), count)
+        yield phases
+
+        entries = GaugeMetricFamily("k8tre_portal_cache_entries", "Entries in internal caches", labels=["cache"])
+        for name, cache in TTLCache.instances.items():
+            entries.add_metric([name], len(cache))
+        if isinstance(session_store, MemorySessionStore):
+            entries.add_metric(["sessions"], len(session_store))
+        if isinstance(auth_handle_store, MemorySessionStore):
+            entries.add_metric(["auth_handle_store"], len(auth_handle_store))
+        yield entries
+
+
+REGISTRY.register(PortalCollector())
+
+
+@app.get("/metrics", dependencies=[Depends(verify_metrics_token)])
+def metrics():
+    """ Prometheus metrics, scraped with a service account token
+    """
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)